@@ -0,0 +1,136 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from bench.catalog import Connection, generate_catalog
+from lib.db import (
+    DEFAULT_CHUNK_SIZE,
+    fetch_chunked,
+    format_data,
+    get_connection_tunnel,
+    get_resource_ids,
+    legacy_hash,
+    refresh_latest_versions,
+    resource_info_queries,
+)
+from lib.util import get_config
+
+# Compares the "latest version per resource" strategies of lib/db.py on a
+# generated catalog (SQLite) or, with --config, read-only on a MySQL catalog.
+# Every strategy must return the rows of the legacy (original) query, and
+# pivot them into resources with the same key order and so the same
+# legacy_hash, which the migration of the manifest.txt state relies on.
+# Exits with status 1 otherwise.
+#
+#   python -m bench.bench_resource_query --resources 20000
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resources", type=int, default=5000)
+    parser.add_argument("--max_versions", type=int, default=4)
+    parser.add_argument("--chunk_size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--strategies",
+        default=",".join(resource_info_queries),
+        help="comma separated list of strategies to run",
+    )
+    parser.add_argument(
+        "--no_indexes", action="store_true", help="generate the catalog without indexes"
+    )
+    parser.add_argument(
+        "--config",
+        help="run against the MySQL catalog of this config file instead of a "
+        "generated one. The materialized strategy writes resource_latest_version",
+    )
+    parser.add_argument("--tunnel", action="store_true")
+    return parser.parse_args()
+
+
+def run_strategy(conn, strategy, resource_ids, chunk_size):
+    start = time.perf_counter()
+    if strategy == "materialized":
+        refresh_latest_versions(conn)
+    rows = fetch_chunked(
+        conn, resource_info_queries[strategy], resource_ids, chunk_size
+    )
+    return time.perf_counter() - start, rows
+
+
+def main():
+    args = get_args()
+    ssh_tunnel = None
+    if args.config:
+        conn, ssh_tunnel = get_connection_tunnel(args.tunnel, get_config(args.config))
+    else:
+        db_path = os.path.join(tempfile.mkdtemp(), "catalog.sqlite")
+        start = time.perf_counter()
+        generate_catalog(
+            db_path,
+            args.resources,
+            args.max_versions,
+            indexes=not args.no_indexes,
+        )
+        print(
+            "Generated {} resources in {:.1f}s".format(
+                args.resources, time.perf_counter() - start
+            )
+        )
+        conn = Connection(db_path)
+
+    resource_ids = get_resource_ids(conn)
+    print(f"{len(resource_ids)} curated resources, chunk size {args.chunk_size}")
+
+    strategies = args.strategies.split(",")
+    # the legacy query is the reference when it is run
+    strategies.sort(key=lambda strategy: strategy != "legacy")
+    reference = None
+    results = {}
+    failed = False
+    for strategy in strategies:
+        timings = []
+        for _ in range(args.repeat):
+            seconds, rows = run_strategy(conn, strategy, resource_ids, args.chunk_size)
+            timings.append(seconds)
+        keys = {
+            resource["rid"]: (tuple(resource), legacy_hash(resource))
+            for resource in format_data(rows)
+        }
+        rows = sorted(
+            (row["rid"], row["name"], row["value"], row["version"]) for row in rows
+        )
+        if reference is None:
+            reference = (strategies[0], rows, keys)
+        elif rows != reference[1]:
+            print(f"{strategy}: result differs from {reference[0]}")
+            failed = True
+        else:
+            reordered = sum(
+                1 for rid, key in keys.items() if reference[2].get(rid) != key
+            )
+            if reordered:
+                print(
+                    f"{strategy}: {reordered} resources have another key order "
+                    f"(legacy hash) than with {reference[0]}"
+                )
+                failed = True
+        results[strategy] = (min(timings), len(rows))
+
+    baseline = results.get("legacy")
+    print("{:<14}{:>10}{:>12}{:>10}".format("strategy", "rows", "best (s)", "speedup"))
+    for strategy, (seconds, count) in results.items():
+        speedup = baseline[0] / seconds if baseline and seconds > 0 else 0
+        print(f"{strategy:<14}{count:>10}{seconds:>12.3f}{speedup:>9.1f}x")
+
+    conn.close()
+    if ssh_tunnel is not None:
+        ssh_tunnel.stop()
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
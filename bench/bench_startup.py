@@ -0,0 +1,216 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.osc_stub import start_stub
+
+# Startup cost of the command line entry points: wall time of every
+# osc_client operation (against the local OSC stub) and of main.py --help,
+# each in a fresh interpreter, next to the time spent importing modules and
+# which heavy optional dependencies got loaded on the way.
+#
+# It exits with status 1 if a command loads a heavy module it is not
+# expected to need (see commands) or if the median of a command exceeds
+# --max_ms, so it can run as a CI check:
+#
+#   python -m bench.bench_startup --repeat 5
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# generous, so the check does not fail on a slow CI machine; the heavy
+# module check catches an eager import on any machine
+DEFAULT_MAX_MS = 1000
+
+# modules that should only be loaded by the operations that need them
+HEAVY_MODULES = (
+    "sshtunnel",
+    "paramiko",
+    "pymysql",
+    "yaml",
+    "sqlite3",
+    "multiprocessing",
+    "orjson",
+    "requests",
+)
+
+TEMPLATE = """Token:
+Files:
+- data.txt
+Directories:
+ExcludeList:
+Title: startup
+Description:
+Keywords:
+DOI:
+URL: https://example.org/startup
+Funding:
+- NSF:
+AssociatedID:
+AssociatedIDVal:
+Acknowledgment:
+"""
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument(
+        "--max_ms",
+        type=float,
+        default=DEFAULT_MAX_MS,
+        help="exit with status 1 if the median of a command exceeds it (0: no limit)",
+    )
+    return parser.parse_args()
+
+
+# (name, argv, heavy modules the command is expected to load)
+def commands(url, osc_id):
+    client = ["-m", "osc.osc_client"]
+    return [
+        ("python -c pass", ["-c", "pass"], ()),
+        (
+            "main.py --help",
+            [os.path.join(ROOT, "main.py"), "--help"],
+            ("yaml", "sqlite3"),
+        ),
+        ("osc_client --help", client + ["--help"], ()),
+        ("query", client + ["query", "--oscid", osc_id, "--url", url], ("requests",)),
+        (
+            "export",
+            client
+            + ["export", "--oscid", osc_id, "--output", "export.jsonl", "--url", url],
+            ("requests",),
+        ),
+        (
+            "contribute",
+            client
+            + ["contribute", "--template", "contribute.yaml", "--token", "bench"]
+            + ["--url", url],
+            ("yaml", "orjson", "requests"),
+        ),
+        (
+            "update",
+            client
+            + ["update", "--template", f"{osc_id}.yaml", "--token", "bench"]
+            + ["--url", url, "--hash_workers", "1"],
+            ("yaml", "orjson", "requests"),
+        ),
+    ]
+
+
+def run(argv, cwd, env):
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable] + argv,
+        cwd=cwd,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - start, completed.returncode
+
+
+# Returns the total import time in seconds, the number of modules imported
+# and the heavy modules among them
+def import_profile(argv, cwd, env):
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime"] + argv,
+        cwd=cwd,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    total = 0
+    modules = set()
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        try:
+            total += int(fields[0])
+        except ValueError:
+            # header line
+            continue
+        modules.add(fields[2].strip())
+    heavy = [m for m in HEAVY_MODULES if m in modules]
+    return total / 1e6, len(modules), heavy
+
+
+def main():
+    args = get_args()
+    tmp_dir = tempfile.mkdtemp()
+    with open(os.path.join(tmp_dir, "data.txt"), "w") as file:
+        file.write("startup benchmark\n")
+    with open(os.path.join(tmp_dir, "contribute.yaml"), "w") as file:
+        file.write(TEMPLATE)
+    stub = start_stub()
+    record = stub.contribute(
+        {
+            "title": "startup",
+            "description": "",
+            "keywords": [],
+            "url": "https://example.org/startup",
+            "manifest": [
+                {"filename": "data.txt", "hash": "0" * 64, "algorithm": "sha256"}
+            ],
+        }
+    )
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    # the update template is the one saved by a query
+    run(
+        ["-m", "osc.osc_client", "query", "--oscid", record["id"]]
+        + ["--url", stub.url],
+        tmp_dir,
+        env,
+    )
+
+    print(
+        "{:<20}{:>12}{:>10}{:>13}{:>9}  {}".format(
+            "command", "median (ms)", "min (ms)", "imports (ms)", "modules", "heavy"
+        )
+    )
+    slow = []
+    unexpected = []
+    for name, argv, expected in commands(stub.url, record["id"]):
+        times = []
+        for _ in range(args.repeat):
+            seconds, status = run(argv, tmp_dir, env)
+            if status != 0:
+                print(f"{name}: exited with status {status}")
+                break
+            times.append(seconds)
+        if not times:
+            continue
+        imports, modules, heavy = import_profile(argv, tmp_dir, env)
+        median = statistics.median(times) * 1000
+        print(
+            "{:<20}{:>12.1f}{:>10.1f}{:>13.1f}{:>9}  {}".format(
+                name,
+                median,
+                min(times) * 1000,
+                imports * 1000,
+                modules,
+                ",".join(heavy) or "-",
+            )
+        )
+        if args.max_ms and median > args.max_ms:
+            slow.append(name)
+        extra = [m for m in heavy if m not in expected]
+        if extra:
+            unexpected.append("{} ({})".format(name, ",".join(extra)))
+    stub.shutdown()
+    if slow:
+        print("Slower than {:.0f} ms: {}".format(args.max_ms, ", ".join(slow)))
+    if unexpected:
+        print("Unexpected heavy imports: " + ", ".join(unexpected))
+    if slow or unexpected:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
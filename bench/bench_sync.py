@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from bench.catalog import Connection, bump_versions, generate_catalog
+from bench.osc_stub import start_stub
+
+# End-to-end throughput of main.py on a generated catalog (SQLite) against
+# the local OSC stub, fully offline. Every scenario runs main.sync in a fresh
+# process, so the peak RSS is the one of that run:
+#
+#   cold    first run, every resource is contributed
+#   1pct    1% of the resources get a new version and are updated
+#   100pct  every resource gets a new version and is updated
+#
+#   python -m bench.bench_sync --resources 2000 --workers 8 --latency_ms 20
+
+SCENARIOS = ("cold", "1pct", "100pct")
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resources", type=int, default=2000)
+    parser.add_argument("--max_versions", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--latency_ms", type=float, default=20.0)
+    parser.add_argument("--jitter_ms", type=float, default=10.0)
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument(
+        "--max_in_flight",
+        type=int,
+        default=0,
+        help="concurrent requests the stub accepts before answering 429",
+    )
+    parser.add_argument(
+        "--scenarios",
+        default=",".join(SCENARIOS),
+        help="comma separated list of scenarios to run, in order",
+    )
+    parser.add_argument(
+        "--stream", action="store_true", help="run main.py with --stream"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    # internal: run a single sync in this process and write its result
+    parser.add_argument(
+        "--child",
+        nargs=4,
+        metavar=("CATALOG", "WORKING_DIR", "CONFIG", "RESULT"),
+        help=argparse.SUPPRESS,
+    )
+    return parser.parse_args()
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p * (len(values) - 1))))]
+
+
+# Runs main.sync on the catalog and records the time spent on every resource
+def run_sync(db_path, working_dir, config_path, result_path, workers, stream):
+    import main as sync_main
+    from lib.db import ConnectionPool
+    from lib.util import get_config
+
+    config = get_config(config_path)
+    latencies = []
+    failed = []
+    lock = threading.Lock()
+    sync_resource = sync_main.sync_resource
+
+    def timed_sync_resource(resource, osc_id, last_hash, context):
+        start = time.perf_counter()
+        result = sync_resource(resource, osc_id, last_hash, context)
+        with lock:
+            latencies.append(time.perf_counter() - start)
+            if result[1] is None:
+                failed.append(resource["rid"])
+        return result
+
+    sync_main.sync_resource = timed_sync_resource
+    pool = ConnectionPool(lambda: Connection(db_path), config["db"]["pool_size"])
+    args = sync_main.get_args(
+        ["--working_dir", working_dir, "--config", config_path]
+        + ["--workers", str(workers)]
+        + (["--stream"] if stream else [])
+    )
+    start = time.perf_counter()
+    try:
+        sync_main.sync(args, config, pool)
+    finally:
+        pool.close()
+    seconds = time.perf_counter() - start
+    with open(result_path, "w") as file:
+        json.dump(
+            {
+                "resources": len(latencies),
+                "failed": len(failed),
+                "seconds": seconds,
+                "p50": percentile(latencies, 0.5),
+                "p99": percentile(latencies, 0.99),
+                # kilobytes on Linux
+                "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            },
+            file,
+        )
+
+
+def prepare_scenario(scenario, db_path, resources, rng):
+    if scenario == "1pct":
+        bump_versions(db_path, rng.sample(range(resources), max(1, resources // 100)))
+    elif scenario == "100pct":
+        bump_versions(db_path, range(resources))
+    elif scenario != "cold":
+        raise ValueError(f"Unknown scenario '{scenario}'")
+
+
+def main():
+    args = get_args()
+    if args.child:
+        run_sync(*args.child, workers=args.workers, stream=args.stream)
+        return
+
+    tmp_dir = tempfile.mkdtemp()
+    db_path = os.path.join(tmp_dir, "catalog.sqlite")
+    working_dir = os.path.join(tmp_dir, "work")
+    start = time.perf_counter()
+    generate_catalog(db_path, args.resources, args.max_versions, seed=args.seed)
+    print(
+        "Generated {} resources in {:.1f}s".format(
+            args.resources, time.perf_counter() - start
+        )
+    )
+
+    stub = start_stub(
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        error_rate=args.error_rate,
+        max_in_flight=args.max_in_flight,
+    )
+    config_path = os.path.join(tmp_dir, "config.json")
+    with open(config_path, "w") as file:
+        json.dump(
+            {
+                "db": {"pool_size": 4, "chunk_size": 500},
+                "osc": {"token": "bench", "url": stub.url, "retries": 5},
+            },
+            file,
+        )
+    print(
+        "OSC stub at {} ({:.0f}+{:.0f} ms, {:.1%} errors), {} workers".format(
+            stub.url, args.latency_ms, args.jitter_ms, args.error_rate, args.workers
+        )
+    )
+
+    rng = random.Random(args.seed)
+    print(
+        "{:<10}{:>10}{:>8}{:>10}{:>12}{:>10}{:>10}{:>12}".format(
+            "scenario",
+            "synced",
+            "failed",
+            "time (s)",
+            "res/s",
+            "p50 (ms)",
+            "p99 (ms)",
+            "RSS (MB)",
+        )
+    )
+    for scenario in args.scenarios.split(","):
+        prepare_scenario(scenario, db_path, args.resources, rng)
+        result_path = os.path.join(tmp_dir, f"{scenario}.json")
+        command = [sys.executable, "-m", "bench.bench_sync", "--child"]
+        command += [db_path, working_dir, config_path, result_path]
+        command += ["--workers", str(args.workers)]
+        if args.stream:
+            command.append("--stream")
+        completed = subprocess.run(command, stdout=subprocess.DEVNULL)
+        if completed.returncode != 0:
+            print(f"{scenario}: sync exited with status {completed.returncode}")
+            continue
+        with open(result_path, "r") as file:
+            result = json.load(file)
+        synced = result["resources"] - result["failed"]
+        print(
+            "{:<10}{:>10}{:>8}{:>10.2f}{:>12.1f}{:>10.1f}{:>10.1f}{:>12.1f}".format(
+                scenario,
+                synced,
+                result["failed"],
+                result["seconds"],
+                synced / result["seconds"] if result["seconds"] > 0 else 0,
+                result["p50"] * 1000,
+                result["p99"] * 1000,
+                result["peak_rss_kb"] / 1024,
+            )
+        )
+    print(
+        "{} portal requests, {} failed, {} throttled and {} not modified".format(
+            stub.requests, stub.errors, stub.throttled, stub.not_modified
+        )
+    )
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
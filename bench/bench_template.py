@@ -0,0 +1,104 @@
+import argparse
+import random
+import time
+
+import yaml
+
+from bench.catalog import COLUMN_NAMES, FUNDING_AGENCIES, column_value, rid_name
+from lib.util import Dumper, compile_template, fill_template
+
+# Resources rendered per second by the compiled template of lib/util.py,
+# compared to loading, filling and dumping the template with the pure Python
+# PyYAML loader/dumper for every resource. Checks that both produce
+# equivalent documents.
+#
+#   python -m bench.bench_template --resources 5000
+
+TEMPLATE = "./config/script_template.yaml"
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resources", type=int, default=5000)
+    parser.add_argument("--template", default=TEMPLATE)
+    return parser.parse_args()
+
+
+def generate_resources(count, seed=0):
+    rng = random.Random(seed)
+    resources = []
+    for index in range(count):
+        resource = {"version": 1, "rid": rid_name(index)}
+        for name in COLUMN_NAMES:
+            resource[name] = column_value(name, index, 1)
+        if rng.random() < 0.2:
+            resource["Defining Citation"] = None
+        resource["funding"] = [
+            {
+                "agency": rng.choice(FUNDING_AGENCIES[:-1]),
+                "funding_id": (
+                    str(rng.randint(10000, 99999)) if rng.random() > 0.3 else None
+                ),
+            }
+            for _ in range(rng.randint(0, 3))
+        ]
+        resource["hash"] = "%032x" % rng.getrandbits(128)
+        resources.append(resource)
+    return resources
+
+
+def render_legacy(template_file, resource):
+    with open(template_file, "r") as stream:
+        yaml_file = yaml.safe_load(stream)
+    fill_template(yaml_file, resource, f"{resource['rid']}/manifest.txt", "token")
+    return yaml.dump(yaml_file)
+
+
+def render_compiled(template, resource):
+    yaml_file = template.render(resource, f"{resource['rid']}/manifest.txt", "token")
+    return yaml.dump(yaml_file, Dumper=Dumper)
+
+
+def render_in_memory(template, resource):
+    return template.render(resource, f"{resource['rid']}/manifest.txt", "token")
+
+
+def timed(render, resources):
+    start = time.perf_counter()
+    outputs = [render(resource) for resource in resources]
+    return time.perf_counter() - start, outputs
+
+
+def main():
+    args = get_args()
+    resources = generate_resources(args.resources)
+    template = compile_template(args.template)
+
+    legacy_seconds, legacy = timed(lambda r: render_legacy(args.template, r), resources)
+    compiled_seconds, compiled = timed(
+        lambda r: render_compiled(template, r), resources
+    )
+    memory_seconds, _ = timed(lambda r: render_in_memory(template, r), resources)
+
+    # libyaml folds some long double quoted strings at other places than the
+    # pure Python emitter, so documents are compared by the data they load to
+    identical = sum(1 for a, b in zip(legacy, compiled) if a == b)
+    equivalent = sum(
+        1 for a, b in zip(legacy, compiled) if yaml.safe_load(a) == yaml.safe_load(b)
+    )
+    print(f"dumper: {Dumper.__name__}")
+    print(
+        f"{equivalent} of {len(resources)} documents equivalent "
+        f"({identical} byte-identical)"
+    )
+    print("{:<22}{:>12}{:>14}".format("renderer", "seconds", "resources/s"))
+    for name, seconds in (
+        ("load+fill+dump", legacy_seconds),
+        ("compiled+dump", compiled_seconds),
+        ("compiled (in memory)", memory_seconds),
+    ):
+        print(f"{name:<22}{seconds:>12.3f}{len(resources) / seconds:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import random
+import sqlite3
+
+# Synthetic SDF catalog with the schema main.py reads from: resources,
+# resource_columns, resource_relationships and resource_to_osc_mapping. The
+# catalog is stored in SQLite and exposed through a small pymysql-like
+# connection so the queries in lib/db.py run on it unchanged.
+
+CURATED_CID = 56
+COLUMN_NAMES = [
+    "Resource Name",
+    "Description",
+    "Resource URL",
+    "Keywords",
+    "Defining Citation",
+    "Abbreviation",
+    "Synonyms",
+    "Parent Organization",
+    "Related Application",
+    "Additional Resource Types",
+    "Resource Type",
+    "Supercategory",
+    "Availability",
+    "Terms Of Use",
+    "Social URLs",
+    "Alternate IDs",
+    "Old URLs",
+    "Listed By",
+    "Lists",
+    "Website Status",
+]
+FUNDING_AGENCIES = ["NASA", "NIH", "NOAA", "NSF", "DOE", ""]
+
+create_tables_query = """
+CREATE TABLE resources (
+    id INTEGER PRIMARY KEY,
+    rid VARCHAR(255) NOT NULL,
+    cid INT NOT NULL,
+    status VARCHAR(32) NOT NULL
+);
+CREATE TABLE resource_columns (
+    id INTEGER PRIMARY KEY,
+    rid INT NOT NULL,
+    name VARCHAR(255) NOT NULL,
+    `value` TEXT,
+    `version` INT NOT NULL
+);
+CREATE TABLE resource_relationships (
+    id INTEGER PRIMARY KEY,
+    id1 VARCHAR(255) NOT NULL,
+    id2 VARCHAR(255) NOT NULL,
+    reltype_id INT NOT NULL
+);
+CREATE TABLE resource_to_osc_mapping (
+    rid VARCHAR(255) NOT NULL,
+    osc_id VARCHAR(255) NOT NULL
+);
+"""
+
+create_indexes_query = """
+CREATE INDEX resources_rid ON resources (rid);
+CREATE INDEX resources_cid_status ON resources (cid, status);
+CREATE INDEX resource_columns_rid_version ON resource_columns (rid, `version`);
+CREATE INDEX resource_relationships_id2 ON resource_relationships (id2, reltype_id);
+CREATE INDEX resource_to_osc_mapping_rid ON resource_to_osc_mapping (rid);
+"""
+
+
+class Cursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query, args=()):
+        # MySQL session variables have no SQLite equivalent
+        if query.startswith("SET SESSION"):
+            return
+        self._cursor.execute(query.replace("%s", "?"), tuple(args))
+
+    def executemany(self, query, rows):
+        self._cursor.executemany(query.replace("%s", "?"), rows)
+
+    def _row(self, row):
+        return {d[0]: v for d, v in zip(self._cursor.description, row)}
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return None if row is None else self._row(row)
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    def fetchmany(self, size=1):
+        return [self._row(row) for row in self._cursor.fetchmany(size)]
+
+    def __iter__(self):
+        for row in self._cursor:
+            yield self._row(row)
+
+    def close(self):
+        self._cursor.close()
+
+
+class Connection:
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # like InnoDB, an open (streaming) read must not block the OSC id
+        # inserts made on other connections
+        self._conn.execute("PRAGMA journal_mode=WAL")
+
+    def cursor(self, cursor_class=None):
+        return Cursor(self._conn.cursor())
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        self._conn.close()
+
+
+def rid_name(index):
+    return "SCR_%06d" % index
+
+
+def column_value(name, index, version):
+    if name == "Resource URL":
+        return f"https://resource-{index}.example.org/"
+    if name == "Keywords":
+        return ", ".join(f"keyword{(index + k) % 97}" for k in range(5))
+    return f"{name} of resource {index}, revision {version}. " * 3
+
+
+# Creates the catalog in the SQLite database at path. Every curated resource
+# gets between 1 and max_versions versions of every column; mapped is the
+# fraction of resources that already have an OSC id.
+def generate_catalog(
+    path, resources=5000, max_versions=4, mapped=0.0, indexes=True, seed=0
+):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.executescript(create_tables_query)
+    column_rows = []
+    funding_rows = []
+    mapping_rows = []
+    for index in range(resources):
+        resource_id = index + 1
+        rid = rid_name(index)
+        # about one resource in ten is not curated or not in the SDF community
+        cid = CURATED_CID if rng.random() > 0.05 else CURATED_CID + 1
+        status = "Curated" if rng.random() > 0.05 else "Pending"
+        conn.execute(
+            "INSERT INTO resources (id, rid, cid, status) VALUES (?, ?, ?, ?)",
+            (resource_id, rid, cid, status),
+        )
+        for version in range(1, rng.randint(1, max_versions) + 1):
+            # the columns of a version are not written in a fixed order
+            for name in rng.sample(COLUMN_NAMES, len(COLUMN_NAMES)):
+                column_rows.append(
+                    (resource_id, name, column_value(name, index, version), version)
+                )
+        for _ in range(rng.randint(0, 2)):
+            agency = rng.choice(FUNDING_AGENCIES)
+            grant = str(rng.randint(10000, 99999)) if rng.random() > 0.3 else ""
+            funding_rows.append((f"{agency}|||{grant}", rid, 14))
+        if rng.random() < mapped:
+            mapping_rows.append((rid, f"osc-{resource_id:08d}"))
+        if len(column_rows) > 100000:
+            insert_columns(conn, column_rows)
+            column_rows = []
+    insert_columns(conn, column_rows)
+    conn.executemany(
+        "INSERT INTO resource_relationships (id1, id2, reltype_id) VALUES (?, ?, ?)",
+        funding_rows,
+    )
+    conn.executemany(
+        "INSERT INTO resource_to_osc_mapping (rid, osc_id) VALUES (?, ?)",
+        mapping_rows,
+    )
+    if indexes:
+        conn.executescript(create_indexes_query)
+    conn.commit()
+    conn.close()
+
+
+def insert_columns(conn, rows):
+    conn.executemany(
+        "INSERT INTO resource_columns (rid, name, `value`, `version`) "
+        "VALUES (?, ?, ?, ?)",
+        rows,
+    )
+
+
+# Adds a new version of every column for the given resource indexes
+def bump_versions(path, indexes):
+    conn = sqlite3.connect(path)
+    for index in indexes:
+        resource_id = index + 1
+        (version,) = conn.execute(
+            "SELECT MAX(`version`) FROM resource_columns WHERE rid = ?",
+            (resource_id,),
+        ).fetchone()
+        version = (version or 0) + 1
+        names = random.Random(f"{index}-{version}").sample(
+            COLUMN_NAMES, len(COLUMN_NAMES)
+        )
+        insert_columns(
+            conn,
+            [
+                (resource_id, name, column_value(name, index, version), version)
+                for name in names
+            ],
+        )
+    conn.commit()
+    conn.close()
@@ -0,0 +1,268 @@
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# In-memory stand-in for the OSC portal endpoints used by osc/osc_client.py:
+# POST api/data/ (contribute), PUT api/data/ (update), GET api/data/{id}
+# (query) and POST api/search/. Every request is delayed by latency plus a
+# random jitter, and a fraction error_rate of them fails with a 503. Requests
+# beyond max_in_flight concurrent ones are throttled with a 429 and a
+# Retry-After header, like the portal does under load. Records are served
+# with an ETag and a matching If-None-Match is answered with a 304. gzip and
+# deflate request bodies are accepted unless accept_encoded is False, in
+# which case they are rejected with a 415.
+#
+#   python -m bench.osc_stub --port 8000 --latency_ms 50 --error_rate 0.01
+
+DATA = "/api/data/"
+SEARCH = "/api/search/"
+
+
+class OscStub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        max_in_flight=0,
+        retry_after=1,
+        seed=0,
+        accept_encoded=True,
+    ):
+        super().__init__(address, OscStubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_in_flight = max_in_flight
+        self.retry_after = retry_after
+        self.accept_encoded = accept_encoded
+        self.records = {}
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self.not_modified = 0
+        self.body_bytes = 0
+        self.in_flight = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://{}:{}/".format(*self.server_address[:2])
+
+    # Returns the error status the request should fail with, or None
+    def delay(self):
+        with self._lock:
+            self.requests += 1
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                self.throttled += 1
+                return 429
+            self.in_flight += 1
+            delay = self.latency + self._rng.uniform(0, self.jitter)
+            failed = self._rng.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        time.sleep(delay)
+        with self._lock:
+            self.in_flight -= 1
+        return 503 if failed else None
+
+    def contribute(self, data):
+        with self._lock:
+            osc_id = "osc-stub-{:08d}".format(len(self.records) + 1)
+            record = dict(data, id=osc_id)
+            record["docType"] = "org.osc.Contribution"
+            record["fundingAgencies"] = data.get("fundingSupport", [])
+            self.records[osc_id] = record
+        return record
+
+    def update(self, data):
+        with self._lock:
+            if data.get("id") not in self.records:
+                return {"docType": "org.osc.Error", "error_message": "Unknown id"}
+            record = dict(self.records[data["id"]], **data)
+            record["fundingAgencies"] = data.get("fundingSupport", [])
+            self.records[data["id"]] = record
+        return record
+
+    def search(self, term):
+        term = str(term).lower()
+        with self._lock:
+            records = list(self.records.values())
+        return [
+            {k: r.get(k, "") for k in ("id", "title", "description", "keywords")}
+            for r in records
+            if any(
+                term in str(r.get(k, "")).lower()
+                for k in ("id", "title", "description", "keywords")
+            )
+        ]
+
+
+class OscStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are separate writes, with Nagle's algorithm the body
+    # waits for the client's delayed ACK of the headers (~40 ms per request)
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, obj, status=200, etag=None):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_text(self, text, status):
+        body = text.encode()
+        self.send_response(status)
+        if status == 429:
+            self.send_header("Retry-After", str(self.server.retry_after))
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Returns None if the client went away before sending the whole body or
+    # if its encoding is rejected
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if len(body) < length:
+            self.close_connection = True
+            return None
+        with self.server._lock:
+            self.server.body_bytes += len(body)
+        encoding = self.headers.get("Content-Encoding", "identity")
+        if encoding != "identity":
+            if not self.server.accept_encoded or encoding not in ("gzip", "deflate"):
+                self.send_text("Unsupported Media Type", 415)
+                return None
+            body = zlib.decompress(body, 31 if encoding == "gzip" else 15)
+        return json.loads(body or b"{}")
+
+    def send_error_status(self, status):
+        if status == 429:
+            return self.send_text("Too Many Requests", 429)
+        self.send_text("Service Unavailable", 503)
+
+    def do_GET(self):
+        status = self.server.delay()
+        if status:
+            return self.send_error_status(status)
+        if not self.path.startswith(DATA):
+            return self.send_text("Not Found", 404)
+        osc_id = self.path[len(DATA) :]
+        record = self.server.records.get(osc_id)
+        if record is None:
+            record = {"docType": "org.osc.Error", "info": f"{osc_id} not found"}
+            return self.send_json([json.dumps(record)])
+        data = json.dumps(record, sort_keys=True)
+        etag = '"{}"'.format(hashlib.sha1(data.encode()).hexdigest())
+        if self.headers.get("If-None-Match") == etag:
+            with self.server._lock:
+                self.server.not_modified += 1
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        # the portal returns the record as a JSON string inside a list
+        self.send_json([data], etag=etag)
+
+    def do_POST(self):
+        data = self.read_json()
+        if data is None:
+            return
+        status = self.server.delay()
+        if status:
+            return self.send_error_status(status)
+        if self.path == DATA:
+            return self.send_json(self.server.contribute(data))
+        if self.path == SEARCH:
+            return self.send_json(self.server.search(data.get("search", "")))
+        self.send_text("Not Found", 404)
+
+    def do_PUT(self):
+        data = self.read_json()
+        if data is None:
+            return
+        status = self.server.delay()
+        if status:
+            return self.send_error_status(status)
+        if self.path != DATA:
+            return self.send_text("Not Found", 404)
+        self.send_json(self.server.update(data))
+
+
+# Starts the stub on a background thread, port 0 picks a free port
+def start_stub(
+    host="127.0.0.1",
+    port=0,
+    latency=0.0,
+    jitter=0.0,
+    error_rate=0.0,
+    max_in_flight=0,
+    retry_after=1,
+    accept_encoded=True,
+):
+    server = OscStub(
+        (host, port),
+        latency,
+        jitter,
+        error_rate,
+        max_in_flight,
+        retry_after,
+        accept_encoded=accept_encoded,
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency_ms", type=float, default=0.0)
+    parser.add_argument("--jitter_ms", type=float, default=0.0)
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--max_in_flight", type=int, default=0)
+    parser.add_argument("--retry_after", type=int, default=1)
+    parser.add_argument(
+        "--reject_encoded",
+        action="store_true",
+        help="answer requests with a compressed body with a 415",
+    )
+    args = parser.parse_args()
+    server = OscStub(
+        (args.host, args.port),
+        args.latency_ms / 1000,
+        args.jitter_ms / 1000,
+        args.error_rate,
+        args.max_in_flight,
+        args.retry_after,
+        accept_encoded=not args.reject_encoded,
+    )
+    print(f"OSC stub listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == "__main__":
+    main()
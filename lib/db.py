@@ -1,8 +1,134 @@
-import pymysql
 import hashlib
-from sshtunnel import SSHTunnelForwarder
+import json
+import queue
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from lib.metrics import count, timer
 
+# pymysql and sshtunnel (which loads paramiko and its crypto backends) are
+# imported by the functions that use them, so importing this module is cheap
+# and a run without --tunnel never loads sshtunnel.
+
+# Number of rids sent in a single IN (...) clause
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_POOL_SIZE = 4
+DEFAULT_LATEST_VERSION_STRATEGY = "inlist"
+# Resources in the first batch of a stream, see stream_resources
+DEFAULT_FIRST_BATCH = 8
+# Seconds the server waits on a streaming client that is not reading
+DEFAULT_STREAM_WRITE_TIMEOUT = 3600
+# Times a read is retried on a new connection after the connection was lost
+DEFAULT_READ_RETRIES = 3
+# Seconds a pooled connection may sit idle before it is pinged on checkout
+DEFAULT_PING_INTERVAL = 60
+# Seconds between SSH keepalive packets on the tunnel, 0 to disable them
+DEFAULT_SSH_KEEPALIVE = 30
+# Longest wait between two reconnect attempts, in seconds
+MAX_RECONNECT_DELAY = 30
+# Resource fields that end up in the OSC record (see lib/util.fill_template).
+# Only these are covered by the resource fingerprint.
+OSC_FIELDS = (
+    "Resource Name",
+    "Description",
+    "Resource URL",
+    "Keywords",
+    "Defining Citation",
+    "funding",
+)
+# Keys added to a resource after it is read, not part of the legacy hash
+DERIVED_KEYS = ("hash", "field_digests", "funding")
+
+# The resource info queries below return the columns of a resource in
+# resource_columns.id order. That is the order in which the original query
+# (legacy_resource_info_query), driven by resource_columns, returned them and
+# so the key order that legacy_hash needs to reproduce the manifest.txt hash
+# of earlier runs. The id is returned as column_id and is not pivoted.
+
+# Latest version of every column of the requested resources. The subquery
+# that finds the latest version is restricted to the same IN list, so only
+# the requested rids are grouped instead of the whole resource_columns table.
+# Both IN lists are driven by indexes on resources (rid) and
+# resource_columns (rid, version).
 resource_info_query = """SELECT DISTINCT
+    resources.rid,
+    resource_columns.name,
+    resource_columns. `value`,
+    resource_columns. `version`,
+    resource_columns.id column_id
+FROM
+    resources
+    INNER JOIN resource_columns ON resource_columns.rid = resources.id
+    INNER JOIN (
+        SELECT
+            resources.rid,
+            MAX(resource_columns. `version`) `version`
+        FROM
+            resources
+            INNER JOIN resource_columns ON resource_columns.rid = resources.id
+        WHERE
+            resources.rid in(%s)
+        GROUP BY
+            resources.rid) max_table ON resources.rid = max_table.rid
+    AND resource_columns. `version` = max_table.version
+WHERE
+    resources.rid in(%s)
+ORDER BY
+    resources.rid,
+    resource_columns.id"""
+
+# Same result with a window function (MySQL 8+), single pass over the rows
+# of the requested resources.
+window_resource_info_query = """SELECT DISTINCT
+    rid,
+    name,
+    `value`,
+    `version`,
+    column_id
+FROM (
+    SELECT
+        resources.rid,
+        resource_columns.name,
+        resource_columns. `value`,
+        resource_columns. `version`,
+        resource_columns.id column_id,
+        MAX(resource_columns. `version`) OVER (PARTITION BY resources.rid) max_version
+    FROM
+        resources
+        INNER JOIN resource_columns ON resource_columns.rid = resources.id
+    WHERE
+        resources.rid in(%s)) versions
+WHERE
+    `version` = max_version
+ORDER BY
+    rid,
+    column_id"""
+
+# Same result using resource_latest_version, which is refreshed once per run
+# by refresh_latest_versions (needs CREATE/INSERT privileges).
+materialized_resource_info_query = """SELECT DISTINCT
+    resources.rid,
+    resource_columns.name,
+    resource_columns. `value`,
+    resource_columns. `version`,
+    resource_columns.id column_id
+FROM
+    resources
+    INNER JOIN resource_latest_version ON resource_latest_version.rid = resources.rid
+    INNER JOIN resource_columns ON resource_columns.rid = resources.id
+    AND resource_columns. `version` = resource_latest_version.version
+WHERE
+    resources.rid in(%s)
+ORDER BY
+    resources.rid,
+    resource_columns.id"""
+
+# Original query, kept for comparison. It groups the whole resource_columns
+# table for every statement.
+legacy_resource_info_query = """SELECT DISTINCT
     resources.rid,
     resource_columns.name,
     resource_columns. `value`,
@@ -23,6 +149,60 @@ FROM
 WHERE
     resources.rid in(%s)"""
 
+resource_info_queries = {
+    "inlist": resource_info_query,
+    "window": window_resource_info_query,
+    "materialized": materialized_resource_info_query,
+    "legacy": legacy_resource_info_query,
+}
+
+# Latest version of every curated resource in a single statement, ordered by
+# rid so that the rows of a resource are contiguous and can be pivoted while
+# they are streamed.
+stream_resource_info_query = """SELECT DISTINCT
+    resources.rid,
+    resource_columns.name,
+    resource_columns. `value`,
+    resource_columns. `version`,
+    resource_columns.id column_id
+FROM
+    resources
+    INNER JOIN resource_columns ON resource_columns.rid = resources.id
+    INNER JOIN (
+        SELECT
+            resource_columns.rid,
+            MAX(resource_columns. `version`) `version`
+        FROM
+            resource_columns
+        GROUP BY
+            resource_columns.rid) max_table ON max_table.rid = resources.id
+    AND resource_columns. `version` = max_table.version
+WHERE
+    resources.cid = 56
+    AND resources.status = 'Curated'
+ORDER BY
+    resources.rid,
+    resource_columns.id"""
+
+# Same, resumed after a rid (used to reopen the stream on a new connection)
+stream_resource_info_after_query = stream_resource_info_query.replace(
+    "\nORDER BY", "\n    AND resources.rid > %s\nORDER BY"
+)
+
+create_latest_version_query = """CREATE TABLE IF NOT EXISTS resource_latest_version (
+    rid VARCHAR(255) NOT NULL PRIMARY KEY,
+    `version` INT NOT NULL)"""
+
+refresh_latest_version_query = """REPLACE INTO resource_latest_version (rid, `version`)
+SELECT
+    resources.rid,
+    MAX(resource_columns. `version`)
+FROM
+    resources
+    INNER JOIN resource_columns ON resource_columns.rid = resources.id
+GROUP BY
+    resources.rid"""
+
 funding_info_query = """SELECT
     resource_relationships.id1,
     resource_relationships.id2
@@ -33,6 +213,19 @@ WHERE
     AND resource_relationships.id2 in (%s)"""
 
 
+# Latest version of every curated resource, used as the sync watermark
+resource_version_query = """SELECT
+    resources.rid,
+    MAX(resource_columns. `version`) `version`
+FROM
+    resources
+    INNER JOIN resource_columns ON resource_columns.rid = resources.id
+WHERE
+    resources.cid = 56
+    AND resources.status = 'Curated'
+GROUP BY
+    resources.rid"""
+
 osc_id_query = """SELECT
     rid,
     osc_id
@@ -40,38 +233,227 @@ FROM
     resource_to_osc_mapping"""
 
 
+chunk_osc_id_query = """SELECT
+    rid,
+    osc_id
+FROM
+    resource_to_osc_mapping
+WHERE
+    rid in (%s)"""
+
 insert_osc_id_query = """
     INSERT INTO resource_to_osc_mapping  (rid, osc_id)
     VALUES (%s, %s)
 """
 
 
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+# MySQL client errors raised when the server connection is gone: can't
+# connect, server has gone away, lost connection during query, lost
+# connection to server
+CONNECTION_ERROR_CODES = {2003, 2006, 2013, 2055}
+
+
+# True if err means the connection (or the tunnel under it) was lost, so the
+# query can be retried on a new connection
+def is_connection_error(err):
+    if isinstance(err, (ConnectionError, TimeoutError)):
+        return True
+    # pymysql is only loaded once a real connection was opened
+    pymysql = sys.modules.get("pymysql")
+    if pymysql is None:
+        return False
+    if isinstance(err, pymysql.err.InterfaceError):
+        return True
+    return (
+        isinstance(err, pymysql.err.OperationalError)
+        and bool(err.args)
+        and err.args[0] in CONNECTION_ERROR_CODES
+    )
+
+
+# Small pool of DB connections. Connections are opened lazily, at most `size`
+# are in use at a time, and a connection that raised is closed instead of
+# being handed out again. A connection that sat idle for ping_interval
+# seconds is pinged before it is handed out and replaced if it is dead.
+# Queries run through run() are retried up to `retries` times on a new
+# connection when the connection is lost; only idempotent reads belong there.
+class ConnectionPool:
+    def __init__(
+        self,
+        connect,
+        size=DEFAULT_POOL_SIZE,
+        retries=DEFAULT_READ_RETRIES,
+        ping_interval=DEFAULT_PING_INTERVAL,
+    ):
+        self.size = size
+        self.retries = retries
+        self.ping_interval = ping_interval
+        self._connect = connect
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def put(self, conn):
+        self._idle.put((conn, time.monotonic()))
+
+    def _checkout(self):
+        try:
+            conn, last_used = self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+        if time.monotonic() - last_used < self.ping_interval or not hasattr(
+            conn, "ping"
+        ):
+            return conn
+        try:
+            # no reconnect in place: a restarted tunnel may listen on another
+            # port, self._connect knows which
+            conn.ping(reconnect=False)
+            return conn
+        except Exception as err:
+            print(f"Dropping a dead DB connection: {err}")
+            count("db_dead_connections")
+            close_quietly(conn)
+            return self._connect()
+
+    @contextmanager
+    def connection(self):
+        with self._slots:
+            conn = self._checkout()
+            try:
+                yield conn
+            except Exception:
+                close_quietly(conn)
+                raise
+            self.put(conn)
+
+    # Returns func(conn, *args), run again on a new connection if the
+    # connection was lost
+    def run(self, func, *args):
+        attempt = 0
+        while True:
+            try:
+                with self.connection() as conn:
+                    return func(conn, *args)
+            except Exception as err:
+                if not self.recover(err, attempt):
+                    raise
+                attempt += 1
+
+    # Returns True if err is a lost connection and attempt is not the last
+    # one, after dropping the idle connections (they went through the same
+    # server or tunnel) and waiting before the next attempt
+    def recover(self, err, attempt):
+        if attempt >= self.retries or not is_connection_error(err):
+            return False
+        print(
+            f"Lost the DB connection ({err}), retrying "
+            f"({attempt + 1} of {self.retries})"
+        )
+        count("db_reconnects")
+        self.close()
+        time.sleep(min(MAX_RECONNECT_DELAY, 0.5 * 2**attempt))
+        return True
+
+    def close(self):
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            close_quietly(conn)
+
+
+def close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        # closing a dead connection may raise
+        pass
+
+
+# Pivots the (rid, name, value, version) rows into one dict per resource, in
+# order of first appearance. The rows of a resource do not need to be
+# contiguous, the legacy query has no ORDER BY.
 def format_data(data):
-    new_data = []
-    seen = set()
-    new_dict = {}
+    resources = {}
     for d in data:
-        rid = d["rid"]
-        if rid not in seen:
-            if len(new_dict) > 0:
-                new_data.append(new_dict)
-            seen.add(rid)
-            new_dict = {"version": d["version"], "rid": rid}
-        new_dict[d["name"]] = d["value"]
-    new_data.append(new_dict)
-    return new_data
+        resource = resources.get(d["rid"])
+        if resource is None:
+            resource = {"version": d["version"], "rid": d["rid"]}
+            resources[d["rid"]] = resource
+        resource[d["name"]] = d["value"]
+    return list(resources.values())
 
 
 def format_funding(resource, finding_info):
     pass
 
 
+# Hash written to manifest.txt by earlier versions. It depends on the order
+# of the keys (see the note on the resource info queries) and covers the
+# version, so it is only used to migrate the state of earlier runs.
 def hash_resource(resource):
     string_to_hash = "".join([str(x) for x in resource.values()])
     return hashlib.md5(string_to_hash.encode()).hexdigest()
 
 
+def legacy_hash(resource):
+    return hash_resource({k: v for k, v in resource.items() if k not in DERIVED_KEYS})
+
+
+# Length prefixed, so that no two different values serialize the same way.
+# Funding entries are sorted, the DB returns them in no particular order.
+def canonical_value(value):
+    if value is None:
+        return b"N"
+    if isinstance(value, list):
+        value = json.dumps(
+            sorted(json.dumps(v, sort_keys=True) for v in value), separators=(",", ":")
+        )
+    data = str(value).encode()
+    return b"S%d:%s" % (len(data), data)
+
+
+def field_digest(value):
+    return hashlib.blake2b(canonical_value(value), digest_size=8).hexdigest()
+
+
+# Sets resource["field_digests"] to the digest of every OSC field and
+# resource["hash"] to a fingerprint over the sorted (field, digest) pairs.
+# Neither depends on the order of the keys or rows.
+def fingerprint_resource(resource):
+    digests = {}
+    for field in OSC_FIELDS:
+        value = resource.get(field)
+        if field == "funding" and value is None:
+            value = []
+        digests[field] = field_digest(value)
+    fingerprint = hashlib.blake2b(digest_size=16)
+    for field in sorted(digests):
+        name = field.encode()
+        fingerprint.update(b"%d:%s%s" % (len(name), name, digests[field].encode()))
+    resource["field_digests"] = digests
+    resource["hash"] = fingerprint.hexdigest()
+    return resource
+
+
+# Fields whose digest differs between two field_digests dicts
+def changed_fields(old_digests, new_digests):
+    return sorted(
+        field
+        for field in set(old_digests) | set(new_digests)
+        if old_digests.get(field) != new_digests.get(field)
+    )
+
+
 def get_connection(user, password, db, host, port):
+    import pymysql
+
     return pymysql.connect(
         host=host,
         user=user,
@@ -82,41 +464,132 @@ def get_connection(user, password, db, host, port):
     )
 
 
-def get_connection_tunnel(tunnel, config):
+# True if something accepts TCP connections on the local port, e.g. an
+# `ssh -L` forward kept open outside of this program
+def local_port_open(port):
+    if not port:
+        return False
+    try:
+        socket.create_connection(("127.0.0.1", port), timeout=1).close()
+        return True
+    except OSError:
+        return False
 
-    db_username = config["db"]["username"]
-    db_password = config["db"]["password"]
-    db_host = config["db"]["host"]
-    db_name = config["db"]["name"]
-    db_port = config["db"]["port"]
-    if tunnel:
-        ssh_username = config["ssh"]["username"]
-        ssh_host = config["ssh"]["host"]
-        ssh_pkey = config["ssh"]["pkey"]
-        ssh_bind_address = config["ssh"]["bind_address"]
-        ssh_port = config["ssh"]["port"]
-        forward_tunnel = SSHTunnelForwarder(
-            (ssh_host, ssh_port),
-            ssh_username=ssh_username,
-            ssh_pkey=ssh_pkey,
-            remote_bind_address=(ssh_bind_address, db_port),
+
+# SSH tunnel to the DB host. If config["ssh"]["local_port"] is set and already
+# forwarded (by a long-lived ssh or autossh) that forward is used as is,
+# otherwise a tunnel is started on it (on a free port if it is not set). The
+# SSH transport sends keepalives every config["ssh"]["keepalive"] seconds so
+# idle NAT and firewall state is not dropped, and ensure() restarts a tunnel
+# that went down.
+class DbTunnel:
+    def __init__(self, config):
+        self.ssh = config["ssh"]
+        self.db_port = config["db"]["port"]
+        self.local_port = self.ssh.get("local_port")
+        self.forwarder = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if local_port_open(self.local_port):
+            print(f"Using the existing forward on local port {self.local_port}")
+            return
+        from sshtunnel import SSHTunnelForwarder
+
+        self.forwarder = SSHTunnelForwarder(
+            (self.ssh["host"], self.ssh["port"]),
+            ssh_username=self.ssh["username"],
+            ssh_pkey=self.ssh["pkey"],
+            remote_bind_address=(self.ssh["bind_address"], self.db_port),
+            local_bind_address=("127.0.0.1", self.local_port or 0),
+            set_keepalive=self.ssh.get("keepalive", DEFAULT_SSH_KEEPALIVE),
         )
-        forward_tunnel.start()
-        port = forward_tunnel.local_bind_address[1]
-        try:
-            connection = get_connection(
-                db_username, db_password, db_name, db_host, port
-            )
-            return connection, forward_tunnel
-        except Exception as err:
-            print(err)
-            print("Failed to Connect")
-    else:
-        return (
-            get_connection(db_username, db_password, db_name, db_host, db_port),
-            None,
+        self.forwarder.start()
+
+    @property
+    def port(self):
+        if self.forwarder is None:
+            return self.local_port
+        return self.forwarder.local_bind_port
+
+    # Restarts the tunnel if it is down. Called before every new connection.
+    def ensure(self):
+        with self._lock:
+            if self.forwarder is None:
+                if not local_port_open(self.local_port):
+                    print(f"The forward on local port {self.local_port} is gone")
+                    count("ssh_tunnel_restarts")
+                    self.start()
+                return
+            self.forwarder.check_tunnels()
+            if self.forwarder.is_active and all(self.forwarder.tunnel_is_up.values()):
+                return
+            print("The SSH tunnel is down, restarting it")
+            count("ssh_tunnel_restarts")
+            self.forwarder.restart()
+
+    def stop(self):
+        if self.forwarder is not None:
+            self.forwarder.stop()
+            self.forwarder = None
+
+
+# Returns a function opening a new connection to the configured DB, through
+# db_tunnel if it is not None
+def connection_factory(config, db_tunnel=None):
+    def connect():
+        port = config["db"]["port"]
+        if db_tunnel is not None:
+            db_tunnel.ensure()
+            port = db_tunnel.port
+        return get_connection(
+            config["db"]["username"],
+            config["db"]["password"],
+            config["db"]["name"],
+            config["db"]["host"],
+            port,
         )
 
+    return connect
+
+
+# Returns a single connection and the DbTunnel it goes through (None without
+# tunnel). Raises if the DB cannot be reached.
+def get_connection_tunnel(tunnel, config):
+    db_tunnel = None
+    if tunnel:
+        db_tunnel = DbTunnel(config)
+        db_tunnel.start()
+    try:
+        return connection_factory(config, db_tunnel)(), db_tunnel
+    except Exception:
+        if db_tunnel is not None:
+            db_tunnel.stop()
+        raise
+
+
+# Returns the connection pool and the DbTunnel it goes through (None without
+# tunnel). The first connection is opened right away, with the same retries
+# as the reads, so a DB that cannot be reached fails the run here.
+def get_connection_pool(tunnel, config, size=DEFAULT_POOL_SIZE):
+    db_tunnel = None
+    if tunnel:
+        db_tunnel = DbTunnel(config)
+        db_tunnel.start()
+    pool = ConnectionPool(
+        connection_factory(config, db_tunnel),
+        size,
+        retries=config["db"].get("read_retries", DEFAULT_READ_RETRIES),
+        ping_interval=config["db"].get("ping_interval", DEFAULT_PING_INTERVAL),
+    )
+    try:
+        pool.run(lambda conn: None)
+    except Exception:
+        if db_tunnel is not None:
+            db_tunnel.stop()
+        raise
+    return pool, db_tunnel
+
 
 def get_resource_ids(conn):
     cursor = conn.cursor()
@@ -127,14 +600,36 @@ def get_resource_ids(conn):
     return result
 
 
-def get_funding_info(conn, resources):
-    ids = tuple([resource["rid"] for resource in resources])
-    ids_format = ",".join(["%s"] * len(ids))
+def get_resource_versions(conn):
     cursor = conn.cursor()
-    cursor.execute(funding_info_query % ids_format, (ids))
+    cursor.execute(resource_version_query)
     result = cursor.fetchall()
     cursor.close()
+    return {d["rid"]: d["version"] for d in result}
+
+
+# Every %s in query is an IN list of ids. The time spent is recorded in the
+# stage histogram under the given stage name.
+def fetch_chunk(conn, query, ids, stage="db_query"):
+    ids_format = ",".join(["%s"] * len(ids))
+    n_lists = query.count("%s")
+    with timer("stage", stage=stage):
+        cursor = conn.cursor()
+        cursor.execute(query % ((ids_format,) * n_lists), (ids * n_lists))
+        result = cursor.fetchall()
+        cursor.close()
+    return result
+
+
+def fetch_chunked(conn, query, resources, chunk_size=DEFAULT_CHUNK_SIZE):
+    ids = tuple([resource["rid"] for resource in resources])
+    result = []
+    for chunk in chunked(ids, chunk_size):
+        result.extend(fetch_chunk(conn, query, chunk))
+    return result
 
+
+def format_funding_info(result):
     formatted_data = {}
     for d in result:
         if d["id2"] not in formatted_data:
@@ -153,25 +648,95 @@ def get_funding_info(conn, resources):
     return formatted_data
 
 
-def get_resource_info(conn, resources):
-    ids = tuple([resource["rid"] for resource in resources])
-    ids_format = ",".join(["%s"] * len(ids))
-    cursor = conn.cursor()
-    cursor.execute(resource_info_query % ids_format, (ids))
-    result = cursor.fetchall()
-
-    cursor.close()
+def format_resource_info(result, funding_info=None):
     formatted_data = format_data(result)
     for d in formatted_data:
-        d["hash"] = hash_resource(d)
+        if funding_info is not None and d["rid"] in funding_info:
+            d["funding"] = funding_info[d["rid"]]
+        fingerprint_resource(d)
     return formatted_data
 
 
-def get_osc_ids(conn):
+def get_funding_info(conn, resources, chunk_size=DEFAULT_CHUNK_SIZE):
+    result = fetch_chunked(conn, funding_info_query, resources, chunk_size)
+    return format_funding_info(result)
+
+
+def get_resource_info(
+    conn,
+    resources,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    strategy=DEFAULT_LATEST_VERSION_STRATEGY,
+):
+    query = resource_info_queries[strategy]
+    result = fetch_chunked(conn, query, resources, chunk_size)
+    return format_resource_info(result)
+
+
+def refresh_latest_versions(conn):
     cursor = conn.cursor()
-    cursor.execute(osc_id_query)
-    ids = cursor.fetchall()
+    cursor.execute(create_latest_version_query)
+    cursor.execute(refresh_latest_version_query)
+    conn.commit()
     cursor.close()
+
+
+def pooled(pool, func, *args):
+    return pool.run(func, *args)
+
+
+# Fetches the resource and funding rows of `resources` in chunks of
+# `chunk_size` rids, spreading the chunks over the connection pool. The OSC id
+# mapping is fetched at the same time when with_osc_ids is set. Rows are
+# merged in chunk order, so the result does not depend on which query
+# finishes first.
+def get_resources_parallel(
+    pool,
+    resources,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    with_osc_ids=False,
+    strategy=DEFAULT_LATEST_VERSION_STRATEGY,
+):
+    resource_query = resource_info_queries[strategy]
+    ids = tuple([resource["rid"] for resource in resources])
+    chunks = list(chunked(ids, chunk_size))
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        osc_ids_future = None
+        if with_osc_ids:
+            osc_ids_future = executor.submit(pooled, pool, get_osc_ids)
+        resource_futures = [
+            executor.submit(
+                pooled, pool, fetch_chunk, resource_query, chunk, "resource_info"
+            )
+            for chunk in chunks
+        ]
+        funding_futures = [
+            executor.submit(
+                pooled, pool, fetch_chunk, funding_info_query, chunk, "funding_info"
+            )
+            for chunk in chunks
+        ]
+        resource_rows = []
+        for future in resource_futures:
+            resource_rows.extend(future.result())
+        funding_rows = []
+        for future in funding_futures:
+            funding_rows.extend(future.result())
+        osc_ids = osc_ids_future.result() if osc_ids_future else None
+
+    with timer("stage", stage="format"):
+        resource_info = format_resource_info(
+            resource_rows, format_funding_info(funding_rows)
+        )
+    return resource_info, osc_ids
+
+
+def get_osc_ids(conn):
+    with timer("stage", stage="osc_ids"):
+        cursor = conn.cursor()
+        cursor.execute(osc_id_query)
+        ids = cursor.fetchall()
+        cursor.close()
     osc_id_dict = {}
     for osc_id in ids:
         if osc_id["rid"] not in osc_id_dict:
@@ -180,8 +745,177 @@ def get_osc_ids(conn):
     return osc_id_dict
 
 
+def get_chunk_osc_ids(conn, ids):
+    osc_id_dict = {}
+    for osc_id in fetch_chunk(conn, chunk_osc_id_query, ids, "osc_ids"):
+        if osc_id["rid"] not in osc_id_dict:
+            osc_id_dict[osc_id["rid"]] = osc_id["osc_id"]
+    return osc_id_dict
+
+
+# Yields every curated resource, formatted like format_data, as soon as its
+# last row is read from an unbuffered cursor. Only fetch_size rows are held in
+# memory at a time. The cursor keeps the connection busy until it is
+# exhausted or closed. With after, only the resources with a greater rid are
+# read.
+def stream_resource_info(conn, fetch_size=DEFAULT_CHUNK_SIZE, after=None):
+    import pymysql
+
+    cursor = conn.cursor(pymysql.cursors.SSDictCursor)
+    try:
+        # the server must wait for a slow consumer instead of dropping it
+        cursor.execute(
+            "SET SESSION net_write_timeout = %s", (DEFAULT_STREAM_WRITE_TIMEOUT,)
+        )
+        if after is None:
+            cursor.execute(stream_resource_info_query)
+        else:
+            cursor.execute(stream_resource_info_after_query, (after,))
+        resource = None
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            for d in rows:
+                if resource is None or d["rid"] != resource["rid"]:
+                    if resource is not None:
+                        yield resource
+                    resource = {"version": d["version"], "rid": d["rid"]}
+                resource[d["name"]] = d["value"]
+        if resource is not None:
+            yield resource
+    finally:
+        cursor.close()
+
+
+# Streams the curated resources in batches, each with its funding and the
+# OSC ids of its resources fetched on a second pooled connection. Resources
+# for which keep returns False are dropped before their funding is fetched.
+# Memory use does not depend on the catalog size.
+# Resources are handed over a batch at a time rather than one by one: the
+# funding and OSC ids of a batch take one IN query each, where single
+# resources would take two round trips per resource. So that the first
+# submissions do not wait for a full chunk, the first batch has
+# first_batch resources and the batch size doubles up to chunk_size.
+def stream_resources(
+    pool, chunk_size=DEFAULT_CHUNK_SIZE, keep=None, first_batch=DEFAULT_FIRST_BATCH
+):
+    if pool.size < 2:
+        raise ValueError("Streaming needs a connection pool of at least 2")
+    batch = []
+    batch_size = min(first_batch, chunk_size)
+    for resource in resume_resource_info(pool, chunk_size):
+        if keep is not None and not keep(resource):
+            continue
+        batch.append(resource)
+        if len(batch) >= batch_size:
+            yield add_related_info(pool, batch)
+            batch = []
+            batch_size = min(batch_size * 2, chunk_size)
+    if batch:
+        yield add_related_info(pool, batch)
+
+
+# stream_resource_info on a pooled connection. If the connection is lost the
+# stream is reopened on a new one after the last resource yielded, which was
+# read completely.
+def resume_resource_info(pool, fetch_size):
+    after = None
+    attempt = 0
+    while True:
+        try:
+            with pool.connection() as conn:
+                for resource in stream_resource_info(conn, fetch_size, after):
+                    after = resource["rid"]
+                    attempt = 0
+                    yield resource
+            return
+        except Exception as err:
+            if not pool.recover(err, attempt):
+                raise
+            attempt += 1
+
+
+def add_related_info(pool, resources):
+    ids = tuple([resource["rid"] for resource in resources])
+    funding_info, osc_ids = pool.run(fetch_related_info, ids)
+    with timer("stage", stage="format"):
+        for resource in resources:
+            if resource["rid"] in funding_info:
+                resource["funding"] = funding_info[resource["rid"]]
+            fingerprint_resource(resource)
+    return resources, osc_ids
+
+
+def fetch_related_info(conn, ids):
+    funding_info = format_funding_info(
+        fetch_chunk(conn, funding_info_query, ids, "funding_info")
+    )
+    return funding_info, get_chunk_osc_ids(conn, ids)
+
+
 def insert_osc_id(conn, rid, osc_id):
     cursor = conn.cursor()
     cursor.execute(insert_osc_id_query, (rid, osc_id))
     conn.commit()
     cursor.close()
+
+
+# Buffers (rid, osc_id) pairs and writes them with executemany, one
+# transaction per flush. A flush happens when max_batch pairs are buffered or
+# the oldest pair is max_delay seconds old. Pairs stay buffered if the flush
+# fails; on_flush is called with the pairs that were committed. Callers that
+# need crash safety must record the pairs durably before adding them.
+class OscIdWriter:
+    def __init__(self, pool, max_batch=100, max_delay=5.0, on_flush=None):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.on_flush = on_flush
+        self._pending = []
+        self._first_added = None
+        self._lock = threading.Lock()
+
+    def add(self, rid, osc_id):
+        with self._lock:
+            if not self._pending:
+                self._first_added = time.monotonic()
+            self._pending.append((rid, osc_id))
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        with self._lock:
+            due = len(self._pending) >= self.max_batch or (
+                self._pending and time.monotonic() - self._first_added >= self.max_delay
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            rows = self._pending
+            if not rows:
+                return True
+            try:
+                with timer("stage", stage="osc_id_insert"):
+                    with self.pool.connection() as conn:
+                        insert_osc_ids(conn, rows)
+            except Exception as err:
+                print(f"Could not store {len(rows)} OSC ids: {err}")
+                return False
+            self._pending = []
+        if self.on_flush is not None:
+            self.on_flush(rows)
+        return True
+
+
+def insert_osc_ids(conn, rows):
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(insert_osc_id_query, rows)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
@@ -0,0 +1,211 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Counters and latency histograms of a sync run, keyed by metric name and
+# labels. They are written as JSON lines (one object per metric, appended)
+# and/or as a Prometheus textfile (replaced atomically, for the node
+# exporter textfile collector).
+
+PREFIX = "osc_sync_"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    # Cumulative counts, as Prometheus expects them
+    def cumulative(self):
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Metrics:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.started = time.time()
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(self.buckets)
+            self._histograms[key].observe(seconds)
+
+    # Records the time spent in the block in the {name}_seconds histogram
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            counters = [
+                {"metric": PREFIX + name + "_total", "labels": dict(labels), "value": v}
+                for (name, labels), v in sorted(self._counters.items())
+            ]
+            histograms = [
+                {
+                    "metric": PREFIX + name + "_seconds",
+                    "labels": dict(labels),
+                    "count": h.count,
+                    "sum": h.sum,
+                    "buckets": h.cumulative(),
+                }
+                for (name, labels), h in sorted(self._histograms.items())
+            ]
+        return counters, histograms
+
+    def write_jsonl(self, path):
+        now = time.time()
+        counters, histograms = self.snapshot()
+        with open(path, "a") as file:
+            for metric in counters + histograms:
+                metric = dict(metric, time=now, run_started=self.started)
+                if "buckets" in metric:
+                    metric["buckets"] = {str(b): c for b, c in metric["buckets"]}
+                file.write(json.dumps(metric) + "\n")
+
+    def write_prometheus(self, path):
+        counters, histograms = self.snapshot()
+        lines = []
+        # the TYPE line is written once per metric, before all its label sets
+        typed = set()
+        for metric in counters:
+            name = metric["metric"]
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f'{name}{format_labels(metric["labels"])} {metric["value"]}')
+        for metric in histograms:
+            name = metric["metric"]
+            labels = metric["labels"]
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            for bound, count in metric["buckets"] + [("+Inf", metric["count"])]:
+                bucket_labels = format_labels(dict(labels, le=str(bound)))
+                lines.append(f"{name}_bucket{bucket_labels} {count}")
+            lines.append(f'{name}_sum{format_labels(labels)} {metric["sum"]}')
+            lines.append(f'{name}_count{format_labels(labels)} {metric["count"]}')
+        lines.append(f"# TYPE {PREFIX}last_write_timestamp_seconds gauge")
+        lines.append(f"{PREFIX}last_write_timestamp_seconds {time.time()}")
+        # the collector must never read a partially written file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as file:
+            file.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = []
+    for k, v in sorted(labels.items()):
+        v = str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{k}="{v}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+# Metrics of the current run, shared by every stage
+metrics = Metrics()
+
+
+def count(name, value=1, **labels):
+    metrics.count(name, value, **labels)
+
+
+def observe(name, seconds, **labels):
+    metrics.observe(name, seconds, **labels)
+
+
+def timer(name, **labels):
+    return metrics.timer(name, **labels)
+
+
+# Writes the metrics to jsonl_path and/or prometheus_path every interval
+# seconds (never if interval is 0) and once more on stop().
+class MetricsReporter:
+    def __init__(self, jsonl_path=None, prometheus_path=None, interval=0):
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval > 0 and (self.jsonl_path or self.prometheus_path):
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def write(self):
+        try:
+            if self.jsonl_path:
+                metrics.write_jsonl(self.jsonl_path)
+            if self.prometheus_path:
+                metrics.write_prometheus(self.prometheus_path)
+        except OSError as err:
+            print(f"Could not write metrics: {err}")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.write()
+
+
+def label_string(labels):
+    return "{" + ",".join(f"{k}={v}" for k, v in sorted(labels.items())) + "}"
+
+
+# One line per counter, and per timed stage and HTTP endpoint with its total
+# and mean time
+def print_summary():
+    counters, histograms = metrics.snapshot()
+    for metric in counters:
+        name = metric["metric"][len(PREFIX) :] + label_string(metric["labels"])
+        print("{:<60} {:>8}".format(name, metric["value"]))
+    for metric in histograms:
+        if metric["count"] == 0:
+            continue
+        print(
+            "{:<60} {:>8} calls {:>10.2f}s total {:>9.1f}ms mean".format(
+                metric["metric"][len(PREFIX) :] + label_string(metric["labels"]),
+                metric["count"],
+                metric["sum"],
+                metric["sum"] / metric["count"] * 1000,
+            )
+        )
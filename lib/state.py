@@ -0,0 +1,276 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Local sync state kept in a single SQLite file in the working directory:
+# for every rid the last synced hash (resource fingerprint) and version, the
+# digest of every OSC field, the fields changed by the last update, its OSC
+# id, a fingerprint of the last submitted payload, the last portal response
+# and timestamps.
+# The same file holds a write-ahead journal of the OSC operations in
+# progress and the list of runs, so an interrupted run can be resumed.
+
+create_state_table_query = """CREATE TABLE IF NOT EXISTS sync_state (
+    rid TEXT PRIMARY KEY,
+    hash TEXT,
+    osc_id TEXT,
+    version INTEGER,
+    payload_fingerprint TEXT,
+    receipt TEXT,
+    synced_at REAL,
+    submitted_at REAL,
+    mapping_pending INTEGER,
+    field_digests TEXT,
+    changed_fields TEXT
+)"""
+
+create_osc_id_index_query = """CREATE INDEX IF NOT EXISTS sync_state_osc_id
+    ON sync_state (osc_id)"""
+
+load_state_query = """SELECT
+    rid,
+    hash,
+    osc_id,
+    version,
+    payload_fingerprint,
+    synced_at,
+    submitted_at,
+    mapping_pending
+FROM
+    sync_state"""
+
+field_digests_query = "SELECT field_digests FROM sync_state WHERE rid = ?"
+
+# One row per rid with an OSC operation that was started but whose result is
+# not recorded in sync_state yet
+create_journal_table_query = """CREATE TABLE IF NOT EXISTS journal (
+    rid TEXT PRIMARY KEY,
+    op TEXT NOT NULL,
+    osc_id TEXT,
+    title TEXT,
+    manifest_hash TEXT,
+    hash TEXT,
+    version INTEGER,
+    started_at REAL NOT NULL
+)"""
+
+begin_operation_query = """INSERT OR REPLACE INTO journal
+    (rid, op, osc_id, title, manifest_hash, hash, version, started_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)"""
+
+finish_operation_query = "DELETE FROM journal WHERE rid = ?"
+
+create_runs_table_query = """CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at REAL NOT NULL,
+    finished_at REAL
+)"""
+
+# Columns left as NULL keep their previous value
+upsert_state_query = """INSERT INTO sync_state
+    (rid, hash, osc_id, version, payload_fingerprint, receipt, synced_at,
+     submitted_at, mapping_pending, field_digests, changed_fields)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (rid) DO UPDATE SET
+    hash = COALESCE(excluded.hash, hash),
+    osc_id = COALESCE(excluded.osc_id, osc_id),
+    version = COALESCE(excluded.version, version),
+    payload_fingerprint = COALESCE(excluded.payload_fingerprint,
+        payload_fingerprint),
+    receipt = COALESCE(excluded.receipt, receipt),
+    synced_at = COALESCE(excluded.synced_at, synced_at),
+    submitted_at = COALESCE(excluded.submitted_at, submitted_at),
+    mapping_pending = COALESCE(excluded.mapping_pending, mapping_pending),
+    field_digests = COALESCE(excluded.field_digests, field_digests),
+    changed_fields = COALESCE(excluded.changed_fields, changed_fields)"""
+
+STATE_COLUMNS = (
+    "hash",
+    "osc_id",
+    "version",
+    "payload_fingerprint",
+    "receipt",
+    "synced_at",
+    "submitted_at",
+    # 1 while the OSC id is not stored in resource_to_osc_mapping yet
+    "mapping_pending",
+    # NULL for states written before per-field digests, whose hash is the
+    # legacy manifest.txt hash
+    "field_digests",
+    "changed_fields",
+)
+JSON_COLUMNS = ("receipt", "field_digests", "changed_fields")
+
+
+class StateStore:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # with WAL, commits survive a crash of the process without an fsync
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(create_state_table_query)
+        self._conn.execute(create_journal_table_query)
+        self._conn.execute(create_runs_table_query)
+        columns = [
+            row[1] for row in self._conn.execute("PRAGMA table_info(sync_state)")
+        ]
+        for column in STATE_COLUMNS:
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE sync_state ADD COLUMN {column}")
+        self._conn.execute(create_osc_id_index_query)
+        self._conn.commit()
+
+    def is_empty(self):
+        with self._lock:
+            return (
+                self._conn.execute("SELECT 1 FROM sync_state LIMIT 1").fetchone()
+                is None
+            )
+
+    # Returns {rid: state} for every rid in a single query
+    def load_all(self):
+        with self._lock:
+            cursor = self._conn.execute(load_state_query)
+            columns = [d[0] for d in cursor.description]
+            return {row[0]: dict(zip(columns, row)) for row in cursor.fetchall()}
+
+    def set_mapping_stored(self, rids):
+        self.update_many([(rid, {"mapping_pending": 0}) for rid in rids])
+
+    def get_field_digests(self, rid):
+        return self._get_json(field_digests_query, rid)
+
+    def _get_json(self, query, rid):
+        with self._lock:
+            row = self._conn.execute(query, (rid,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return json.loads(row[0])
+
+    # The journal entries of the rids in finished are removed in the same
+    # transaction
+    def update_many(self, states, finished=()):
+        rows = []
+        for rid, state in states:
+            unknown = set(state) - set(STATE_COLUMNS)
+            if unknown:
+                raise ValueError(f"Unknown state columns {sorted(unknown)}")
+            state = {
+                c: json.dumps(v) if c in JSON_COLUMNS and v is not None else v
+                for c, v in state.items()
+            }
+            rows.append((rid,) + tuple(state.get(c) for c in STATE_COLUMNS))
+        with self._lock:
+            self._conn.executemany(upsert_state_query, rows)
+            self._conn.executemany(finish_operation_query, [(r,) for r in finished])
+            self._conn.commit()
+
+    # Records, durably, that an OSC operation is about to be sent for rid
+    def begin_operation(
+        self,
+        rid,
+        op,
+        osc_id=None,
+        title=None,
+        manifest_hash=None,
+        hash=None,
+        version=None,
+    ):
+        row = (rid, op, osc_id, title, manifest_hash, hash, version, time.time())
+        with self._lock:
+            self._conn.execute(begin_operation_query, row)
+            self._conn.commit()
+
+    def pending_operations(self):
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM journal ORDER BY started_at")
+            columns = [d[0] for d in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    # Returns the run to work on and whether it resumes an interrupted run
+    def start_run(self):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, started_at, finished_at FROM runs ORDER BY id DESC LIMIT 1"
+            ).fetchone()
+            if row is not None and row[2] is None:
+                return {"id": row[0], "started_at": row[1]}, True
+            now = time.time()
+            cursor = self._conn.execute(
+                "INSERT INTO runs (started_at) VALUES (?)", (now,)
+            )
+            self._conn.commit()
+            return {"id": cursor.lastrowid, "started_at": now}, False
+
+    def finish_run(self, run):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE runs SET finished_at = ? WHERE id = ?", (time.time(), run["id"])
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def read_legacy_state(working_dir, rid):
+    rid_dir = os.path.join(working_dir, rid)
+    state = {}
+    try:
+        with open(os.path.join(rid_dir, "manifest.txt"), "r") as file:
+            state["hash"] = file.readline()
+        state["synced_at"] = os.path.getmtime(os.path.join(rid_dir, "manifest.txt"))
+    except OSError:
+        pass
+    # the newest portal response is the receipt of the last submission
+    receipts = []
+    with os.scandir(rid_dir) as entries:
+        for entry in entries:
+            if entry.name.startswith("osc-") and entry.name.endswith(".json"):
+                receipts.append((entry.stat().st_mtime, entry.path))
+    if receipts:
+        submitted_at, receipt_path = max(receipts)
+        try:
+            with open(receipt_path, "r") as file:
+                receipt = json.load(file)
+            state["receipt"] = receipt
+            state["osc_id"] = receipt.get("id")
+            state["submitted_at"] = submitted_at
+        except (OSError, ValueError):
+            pass
+    return state
+
+
+# Imports the per-rid manifest.txt files and {osc_id}.json receipts written
+# by earlier versions of main.py
+def import_legacy_state(store, working_dir):
+    states = []
+    with os.scandir(working_dir) as entries:
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            state = read_legacy_state(working_dir, entry.name)
+            if state:
+                states.append((entry.name, state))
+    store.update_many(states)
+    return len(states)
+
+
+def open_state_store(working_dir):
+    os.makedirs(working_dir, exist_ok=True)
+    store = StateStore(os.path.join(working_dir, "state.sqlite"))
+    if store.is_empty():
+        start = time.perf_counter()
+        count = import_legacy_state(store, working_dir)
+        if count > 0:
+            print(
+                "Imported the state of {} resources in {:.1f}s".format(
+                    count, time.perf_counter() - start
+                )
+            )
+    return store
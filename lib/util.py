@@ -1,42 +1,124 @@
 import yaml
 import json
+import hashlib
+import os
 
 # FUNDING_AGENCIES = set(["NASA", "NIH", "NOAA", "NSF"])
 
+# libyaml loader/dumper when PyYAML was built with it. They produce the same
+# documents as the pure Python ones.
+try:
+    from yaml import CSafeLoader as SafeLoader, CDumper as Dumper
+except ImportError:
+    from yaml import SafeLoader, Dumper
 
-def create_template_yaml(file, data, hash_path, dest, token, update=False):
+
+def fill_template(yaml_file, data, hash_path, token, update=False):
+    yaml_file["Description"] = data.get("Description")
+    yaml_file["Title"] = f"{data.get('Resource Name')} - SDF"
+    yaml_file["URL"] = data.get("Resource URL")
+    yaml_file["Keywords"] = data.get("Keywords")
+    yaml_file["Acknowledgment"] = data.get("Defining Citation")
+    if not update:
+        yaml_file["Files"] = [hash_path]
+    yaml_file["Token"] = token
+    for funding in data.get("funding", []):
+        agency = funding["agency"]
+        funding_id = funding["funding_id"]
+
+        for funding_agency in yaml_file["Funding"]:
+
+            if agency in funding_agency:
+                funding_agency[agency] = True
+                if funding_id:
+                    funding_info = f"\n{agency}: {funding_id}"
+                    if yaml_file["Acknowledgment"] is None:
+                        yaml_file["Acknowledgment"] = funding_info
+                    else:
+                        yaml_file["Acknowledgment"] += funding_info
+    return yaml_file
+
+
+# Template parsed once and rendered for many resources. Gives the same result
+# as fill_template on a freshly loaded copy of the template, without loading
+# it again and with the Funding entry of every agency looked up directly.
+class CompiledTemplate:
+    def __init__(self, template):
+        self.template = template
+        self.agency_entries = {}
+        for index, funding_agency in enumerate(template.get("Funding") or []):
+            for agency in funding_agency:
+                self.agency_entries.setdefault(agency, []).append(index)
+
+    def render(self, data, hash_path, token, update=False):
+        yaml_file = dict(self.template)
+        yaml_file["Description"] = data.get("Description")
+        yaml_file["Title"] = f"{data.get('Resource Name')} - SDF"
+        yaml_file["URL"] = data.get("Resource URL")
+        yaml_file["Keywords"] = data.get("Keywords")
+        if not update:
+            yaml_file["Files"] = [hash_path]
+        yaml_file["Token"] = token
+
+        funding_list = [dict(f) for f in yaml_file.get("Funding") or []]
+        acknowledgment = [data.get("Defining Citation")]
+        for funding in data.get("funding", []):
+            agency = funding["agency"]
+            for index in self.agency_entries.get(agency, ()):
+                funding_list[index][agency] = True
+                if funding["funding_id"]:
+                    acknowledgment.append(f"\n{agency}: {funding['funding_id']}")
+        if yaml_file.get("Funding") is not None:
+            yaml_file["Funding"] = funding_list
+        if len(acknowledgment) > 1 and acknowledgment[0] is None:
+            acknowledgment[0] = ""
+        yaml_file["Acknowledgment"] = (
+            "".join(acknowledgment) if len(acknowledgment) > 1 else acknowledgment[0]
+        )
+        return yaml_file
+
+
+_compiled_templates = {}
+
+
+# Compiled templates are cached per path and reloaded when the file changes
+def compile_template(file):
+    st = os.stat(file)
+    key = (file, st.st_mtime_ns, st.st_size)
+    if key not in _compiled_templates:
+        _compiled_templates[key] = CompiledTemplate(load_template_yaml(file))
+    return _compiled_templates[key]
+
+
+def load_template_yaml(file):
     with open(file, "r") as stream:
-        try:
-            yaml_file = yaml.safe_load(stream)
-            yaml_file["Description"] = data.get("Description")
-            yaml_file["Title"] = f"{data.get('Resource Name')} - SDF"
-            yaml_file["URL"] = data.get("Resource URL")
-            yaml_file["Keywords"] = data.get("Keywords")
-            yaml_file["Acknowledgment"] = data.get("Defining Citation")
-            if not update:
-                yaml_file["Files"] = [hash_path]
-            yaml_file["Token"] = token
-            for funding in data["funding"]:
-                agency = funding["agency"]
-                funding_id = funding["funding_id"]
-
-                for funding_agency in yaml_file["Funding"]:
-
-                    if agency in funding_agency:
-                        funding_agency[agency] = True
-                        if funding_id:
-                            funding_info = f"\n{agency}: {funding_id}"
-                            if yaml_file["Acknowledgment"] is None:
-                                yaml_file["Acknowledgment"] = funding_info
-                            else:
-                                yaml_file["Acknowledgment"] += funding_info
-            with open(f"{dest}", "w") as output:
-                yaml.dump(yaml_file, output)
-        except yaml.YAMLError as err:
-            print(err)
+        return yaml.load(stream, Loader=SafeLoader)
+
+
+def write_template_yaml(yaml_file, dest):
+    with open(f"{dest}", "w") as output:
+        yaml.dump(yaml_file, output, Dumper=Dumper)
+
+
+def create_template_yaml(file, data, hash_path, dest, token, update=False):
+    try:
+        if update:
+            # the file is the record of a single resource, not a shared template
+            yaml_file = load_template_yaml(file)
+            fill_template(yaml_file, data, hash_path, token, update)
+        else:
+            yaml_file = compile_template(file).render(data, hash_path, token)
+        write_template_yaml(yaml_file, dest)
+    except yaml.YAMLError as err:
+        print(err)
 
 
 def get_config(config_file):
     with open(config_file, "r") as config_file:
         config = json.load(config_file)
     return config
+
+
+def fingerprint_data(data):
+    serialized = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode()).hexdigest()
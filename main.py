@@ -1,18 +1,54 @@
 from lib.db import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_LATEST_VERSION_STRATEGY,
+    DEFAULT_POOL_SIZE,
     get_resource_ids,
-    get_resource_info,
-    get_funding_info,
+    get_resource_versions,
+    refresh_latest_versions,
+    get_resources_parallel,
+    get_connection_pool,
     get_osc_ids,
-    get_connection_tunnel,
-    insert_osc_id,
+    stream_resources,
+    changed_fields,
+    legacy_hash,
+    OscIdWriter,
+)
+from lib.metrics import MetricsReporter, count, observe, print_summary, timer
+from lib.state import open_state_store
+from lib.util import (
+    compile_template,
+    fill_template,
+    fingerprint_data,
+    get_config,
+    write_template_yaml,
 )
-from lib.util import create_template_yaml, get_config
 import argparse
+import hashlib
 import os
-from osc.osc_client import query_data, update_data, contribute_data
+import queue
+import threading
+import time
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from osc.osc_client import (
+    configure_record_cache,
+    contribute_record,
+    fetch_record,
+    get_record_cache,
+    search_records,
+    update_record,
+)
+from osc.osc_utils import record_to_template
+from osc.osc_hash import configure_hashing
+from osc.osc_session import (
+    body_stats,
+    configure_session,
+    format_body_stats,
+    limits,
+)
 
 
-def get_args() -> argparse.Namespace:
+def get_args(argv=None) -> argparse.Namespace:
     parser = argparse.ArgumentParser()
     parser.add_argument("--tunnel", action="store_true", help="SHH Tunnel server")
     parser.add_argument(
@@ -25,103 +61,641 @@ def get_args() -> argparse.Namespace:
         "--config", action="store", help="path to config file", required=True
     )
     parser.add_argument("--dev", action="store_true", help="Use dev OSC")
-    return parser.parse_args()
+    parser.add_argument(
+        "--workers",
+        action="store",
+        type=int,
+        default=1,
+        help="Number of resources rendered and submitted to OSC concurrently",
+    )
+    parser.add_argument(
+        "--batch_size",
+        action="store",
+        type=int,
+        default=2000,
+        help="Number of resources fetched from the DB per batch",
+    )
+    parser.add_argument(
+        "--rehash",
+        action="store_true",
+        help="Rehash every manifest file even if it is found in the hash cache",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Process every curated resource instead of only the ones whose "
+        "version changed since the last run (e.g. to pick up funding changes)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream the resources from an unbuffered, rid ordered cursor and "
+        "submit each one as soon as it is read, instead of fetching the list of "
+        "rids first. Memory use stays flat; best suited to full runs",
+    )
+    parser.add_argument(
+        "--debug_yaml",
+        action="store_true",
+        help="Write the template submitted for every resource to its working "
+        "directory",
+    )
+    parser.add_argument(
+        "--metrics_jsonl",
+        action="store",
+        help="Append the run metrics (stage timings, counters) to this JSON "
+        "lines file",
+    )
+    parser.add_argument(
+        "--metrics_prom",
+        action="store",
+        help="Write the run metrics to this Prometheus textfile",
+    )
+    parser.add_argument(
+        "--metrics_interval",
+        action="store",
+        type=float,
+        default=0,
+        help="Also write the metrics every N seconds during the run",
+    )
+    return parser.parse_args(argv)
 
 
-def get_resources(connection):
-    resource_ids = get_resource_ids(connection)
-    resource_info = get_resource_info(connection, resource_ids)
-    funding_info = get_funding_info(connection, resource_ids)
-    osc_ids = get_osc_ids(connection)
-    for resource in resource_info:
-        if resource["rid"] in funding_info:
-            resource["funding"] = funding_info[resource["rid"]]
-    return (resource_info, osc_ids)
+# DB stage of the pipeline: fetch resources batch by batch and hand them over
+# to the submit stage, together with their OSC id and last synced hash, as
+# soon as a batch is formatted. The OSC id mapping is fetched alongside the
+# first batch. When incremental is set only resources whose version moved
+# past the last synced version are fetched. Resources synced after checkpoint,
+# by the interrupted run being resumed, are skipped. With stream the resources
+# are read from a single rid ordered cursor instead (see stream_to_queue).
+def fetch_resources(
+    pool,
+    resource_queue,
+    batch_size,
+    chunk_size,
+    strategy,
+    states,
+    incremental,
+    checkpoint=None,
+    stream=False,
+):
+    try:
+        if stream:
+            stream_to_queue(
+                pool, resource_queue, chunk_size, states, incremental, checkpoint
+            )
+        else:
+            fetch_to_queue(
+                pool,
+                resource_queue,
+                batch_size,
+                chunk_size,
+                strategy,
+                states,
+                incremental,
+                checkpoint,
+            )
+    except Exception as err:
+        count("errors", stage="fetch")
+        resource_queue.put(err)
+    resource_queue.put(None)
+
+
+def fetch_to_queue(
+    pool,
+    resource_queue,
+    batch_size,
+    chunk_size,
+    strategy,
+    states,
+    incremental,
+    checkpoint,
+):
+    # reads, retried on a new connection if the connection is lost
+    if strategy == "materialized":
+        with timer("stage", stage="refresh_latest_versions"):
+            pool.run(refresh_latest_versions)
+    with timer("stage", stage="resource_ids"):
+        resource_ids = pool.run(get_resource_ids)
+    if incremental:
+        with timer("stage", stage="resource_versions"):
+            versions = pool.run(get_resource_versions)
+        total = len(resource_ids)
+        resource_ids = [
+            r
+            for r in resource_ids
+            if r["rid"] in versions
+            and versions[r["rid"]] > last_version(states, r["rid"])
+        ]
+        print(f"{len(resource_ids)} of {total} resources changed")
+    if checkpoint is not None:
+        total = len(resource_ids)
+        resource_ids = [
+            r for r in resource_ids if not synced_since(states, r["rid"], checkpoint)
+        ]
+        skipped = total - len(resource_ids)
+        print(f"{skipped} resources already synced by the resumed run")
+    osc_ids = None
+    for start in range(0, len(resource_ids), batch_size):
+        batch = resource_ids[start : start + batch_size]
+        resource_info, batch_osc_ids = get_resources_parallel(
+            pool,
+            batch,
+            chunk_size,
+            with_osc_ids=osc_ids is None,
+            strategy=strategy,
+        )
+        if osc_ids is None:
+            osc_ids = batch_osc_ids
+        count("resources", len(resource_info), result="fetched")
+        put_resources(resource_queue, resource_info, osc_ids, states)
+
+
+# Streaming variant: the version and checkpoint filters are applied to every
+# resource as it is read, since the rids are not known in advance
+def stream_to_queue(pool, resource_queue, chunk_size, states, incremental, checkpoint):
+    def keep(resource):
+        rid = resource["rid"]
+        if incremental and resource["version"] <= last_version(states, rid):
+            return False
+        return checkpoint is None or not synced_since(states, rid, checkpoint)
+
+    for resources, osc_ids in stream_resources(pool, chunk_size, keep):
+        count("resources", len(resources), result="fetched")
+        put_resources(resource_queue, resources, osc_ids, states)
+
+
+def put_resources(resource_queue, resources, osc_ids, states):
+    for resource in resources:
+        rid = resource["rid"]
+        last_hash = states[rid]["hash"] if rid in states else None
+        resource_queue.put((resource, osc_ids.get(rid), last_hash))
+
+
+def last_version(states, rid):
+    if rid not in states or states[rid]["version"] is None:
+        return -1
+    return states[rid]["version"]
+
+
+def synced_since(states, rid, checkpoint):
+    return rid in states and (states[rid]["synced_at"] or 0) >= checkpoint
+
+
+def template_fingerprint(template):
+    return fingerprint_data({k: v for k, v in template.items() if k != "Token"})
+
+
+def contribute_resource(resource, working_dir, context):
+    hash_filename = f"{working_dir}/manifest.txt"
+    try:
+        with open(hash_filename, "w+") as file:
+            file.write(resource["hash"])
+    except OSError:
+        print(f'Could not write manifest file for {resource["rid"]}')
+        return None, None
+    with timer("stage", stage="render"):
+        template = context["template"].render(resource, hash_filename, context["token"])
+    if context["debug_yaml"]:
+        write_template_yaml(template, f"{working_dir}/template.yaml")
+    # the manifest hash identifies this contribution on the portal if the
+    # run stops before its OSC id is recorded
+    context["store"].begin_operation(
+        resource["rid"],
+        "contribute",
+        title=template["Title"],
+        manifest_hash=hashlib.sha256(resource["hash"].encode()).hexdigest(),
+        hash=resource["hash"],
+        version=resource["version"],
+    )
+    receipts = []
+    osc_id = contribute_record(
+        template,
+        "",
+        context["url"],
+        json_des_path=None,
+        result_callback=receipts.append,
+    )
+    if osc_id == -1:
+        return None, None
+    return osc_id, {
+        "osc_id": osc_id,
+        "payload_fingerprint": template_fingerprint(template),
+        "receipt": receipts[0],
+        "submitted_at": time.time(),
+    }
+
+
+# Updates the OSC record in memory: the queried record is turned into a
+# template, merged with the resource and submitted without intermediate
+# files. With debug_yaml the merged template is also written to
+# {working_dir}/{osc_id}.yaml.
+def update_resource(resource, osc_id, last_hash, working_dir, context):
+    hash_filename = f"{working_dir}/manifest.txt"
+    # Check if hash has been changed
+    if last_hash is None:
+        print(f'No previous sync state for {resource["rid"]}')
+        return None
+    if last_hash == resource["hash"]:
+        return {}
+    changed = find_changed_fields(resource, last_hash, context["store"])
+    if not changed:
+        return {}
+    for field in changed:
+        count("changed_fields", field=field)
+
+    # Update entry with new hash and other fields. The manifest file is part of
+    # the contribution, so it must be written before submitting.
+    with open(hash_filename, "w+") as file:
+        file.write(resource["hash"])
+
+    record = fetch_record(osc_id, context["url"])
+    if record == -1:
+        return None
+    with timer("stage", stage="render"):
+        template = fill_template(
+            record_to_template(record),
+            resource,
+            hash_filename,
+            context["token"],
+            update=True,
+        )
+    if context["debug_yaml"]:
+        write_template_yaml(template, f"{working_dir}/{osc_id}.yaml")
+    context["store"].begin_operation(
+        resource["rid"],
+        "update",
+        osc_id=osc_id,
+        hash=resource["hash"],
+        version=resource["version"],
+    )
+    receipts = []
+    res = update_record(
+        template,
+        None,
+        context["url"],
+        json_result_prefix_path=None,
+        result_callback=receipts.append,
+    )
+    if res == -1:
+        return None
+    return {
+        "osc_id": osc_id,
+        "payload_fingerprint": template_fingerprint(template),
+        "receipt": receipts[0],
+        "submitted_at": time.time(),
+        "changed_fields": changed,
+    }
+
+
+# Returns the OSC fields that changed since the last sync. States written
+# before per-field digests only have the legacy manifest.txt hash: if it still
+# matches, nothing changed and the digests are recorded without an update,
+# otherwise every field is treated as changed. The hash covers the version,
+# so a resource that changed since never matches. One that did not change
+# only matches if its keys come in the order of the earlier run; if not, it
+# gets one needless full update (files rehashed, whole record sent) on the
+# first run after the migration. legacy_hash_mismatches counts both cases.
+def find_changed_fields(resource, last_hash, store):
+    last_digests = store.get_field_digests(resource["rid"])
+    if last_digests is not None:
+        return changed_fields(last_digests, resource["field_digests"])
+    if last_hash == legacy_hash(resource):
+        count("fingerprints_migrated")
+        return []
+    if last_hash is not None:
+        count("legacy_hash_mismatches")
+    return sorted(resource["field_digests"])
+
+
+# Render and submit stage, run on the worker pool. Returns the OSC id of a
+# newly contributed resource, so the caller can store the mapping, and the
+# state to record for the resource, or None if it could not be synced.
+def sync_resource(resource, osc_id, last_hash, context):
+    working_dir = f"{context['working_dir']}/{resource['rid']}"
+    try:
+        os.makedirs(working_dir, exist_ok=True)
+        if osc_id is None:
+            new_osc_id, state = contribute_resource(resource, working_dir, context)
+        else:
+            new_osc_id = None
+            state = update_resource(resource, osc_id, last_hash, working_dir, context)
+    except Exception as err:
+        count("errors", stage="sync")
+        print(f'Failed to sync {resource["rid"]}: {err}')
+        return None, None
+    if state is not None:
+        state.update(
+            hash=resource["hash"],
+            field_digests=resource["field_digests"],
+            version=resource["version"],
+            synced_at=time.time(),
+        )
+    return new_osc_id, state
+
+
+# The state store is committed before the OSC id is buffered, so an OSC id
+# returned by the portal survives a crash before the writer flushes it. The
+# journal entries of the synced resources are removed in the same commit;
+# those of failed contributions are kept, the contribution may have reached
+# the portal, and are reconciled by the next run.
+def store_results(store, osc_id_writer, in_flight, done):
+    states = []
+    new_osc_ids = []
+    for future in done:
+        resource = in_flight.pop(future)
+        new_osc_id, state = future.result()
+        if new_osc_id is not None:
+            state["mapping_pending"] = 1
+            new_osc_ids.append((resource["rid"], new_osc_id))
+        if state is None:
+            count("resources", result="failed")
+            continue
+        if new_osc_id is not None:
+            count("resources", result="created")
+        elif "receipt" in state:
+            count("resources", result="updated")
+        else:
+            count("resources", result="unchanged")
+        states.append((resource["rid"], state))
+    with timer("stage", stage="state_store"):
+        store.update_many(states, finished=[rid for rid, _ in states])
+    for rid, osc_id in new_osc_ids:
+        osc_id_writer.add(rid, osc_id)
+    osc_id_writer.flush_if_due()
+
+
+# Returns the OSC id of the contribution described by a journal entry if it
+# reached the portal, None if it did not and -1 if the portal cannot tell
+def find_contribution(operation, url):
+    results = search_records(operation["title"], url)
+    if results == -1:
+        return -1
+    manifest_name = f'/{operation["rid"]}/manifest.txt'
+    for summary in results:
+        if summary.get("title") != operation["title"]:
+            continue
+        record = fetch_record(summary["id"], url)
+        if record == -1:
+            return -1
+        for entry in record.get("manifest") or []:
+            if (
+                entry["filename"].endswith(manifest_name)
+                and entry["hash"] == operation["manifest_hash"]
+            ):
+                return record["id"]
+    return None
+
+
+# Resolves the operations a previous run started but did not record. A
+# contribution found on the portal is recorded with its OSC id instead of
+# being contributed again; updates are idempotent and are simply redone.
+def reconcile_operations(store, states, url):
+    operations = store.pending_operations()
+    if not operations:
+        return
+    print(f"Reconciling {len(operations)} operations left over from the previous run")
+    found = []
+    checked = 0
+    for operation in operations:
+        rid = operation["rid"]
+        if operation["op"] != "contribute" or (
+            rid in states and states[rid]["osc_id"] is not None
+        ):
+            continue
+        checked += 1
+        osc_id = find_contribution(operation, url)
+        if osc_id == -1:
+            raise RuntimeError(f"Could not reconcile the contribution of {rid}")
+        if osc_id is not None:
+            found.append(
+                (
+                    rid,
+                    {
+                        "osc_id": osc_id,
+                        "hash": operation["hash"],
+                        "version": operation["version"],
+                        "synced_at": time.time(),
+                        "submitted_at": operation["started_at"],
+                        "mapping_pending": 1,
+                    },
+                )
+            )
+    if checked > 0:
+        print(f"{len(found)} of {checked} unrecorded contributions found on the portal")
+    store.update_many(found, finished=[o["rid"] for o in operations])
+    if found:
+        states.update(store.load_all())
+
+
+# Writes the OSC ids that a previous run could not store in the DB
+def recover_osc_ids(pool, states, osc_id_writer, store):
+    pending = [
+        (rid, state["osc_id"])
+        for rid, state in states.items()
+        if state["mapping_pending"] and state["osc_id"] is not None
+    ]
+    if not pending:
+        return
+    stored = pool.run(get_osc_ids)
+    store.set_mapping_stored([rid for rid, _ in pending if rid in stored])
+    missing = [(rid, osc_id) for rid, osc_id in pending if rid not in stored]
+    print(f"Storing {len(missing)} OSC ids left over from the previous run")
+    for rid, osc_id in missing:
+        osc_id_writer.add(rid, osc_id)
+    if not osc_id_writer.flush():
+        raise RuntimeError("Could not store the OSC ids of the previous run")
+
+
+# Labels an OSC request with its endpoint, e.g. api/data/{id}
+def endpoint_label(url):
+    parts = urlparse(url).path.strip("/").split("/")
+    label = "/".join(parts[:2]) + "/"
+    if len(parts) > 2:
+        label += "{id}"
+    return label
+
+
+def observe_request(method, url, status, seconds, attempt):
+    endpoint = endpoint_label(url)
+    observe(
+        "http_request",
+        seconds,
+        method=method,
+        endpoint=endpoint,
+        status=status if status is not None else "error",
+    )
+    if attempt > 0:
+        count("http_retries", method=method, endpoint=endpoint)
+
+
+def observe_hashing(stats):
+    observe("stage", stats.seconds, stage="hash_files")
+    count("hashed_files", stats.files)
+    count("hashed_bytes", stats.bytes)
+    count("hash_cache_hits", stats.cached)
 
 
 def main():
     args = get_args()
     config = get_config(args.config)
-    (db_conn, ssh_tunnel) = get_connection_tunnel(args.tunnel, config)
-    resources, osc_ids = get_resources(db_conn)
+    reporter = MetricsReporter(
+        args.metrics_jsonl, args.metrics_prom, args.metrics_interval
+    )
+    reporter.start()
+    try:
+        with timer("stage", stage="connect"):
+            pool, ssh_tunnel = get_connection_pool(
+                args.tunnel, config, config["db"].get("pool_size", DEFAULT_POOL_SIZE)
+            )
+        try:
+            with timer("stage", stage="run"):
+                sync(args, config, pool)
+        finally:
+            pool.close()
+            if args.tunnel:
+                ssh_tunnel.stop()
+    finally:
+        reporter.stop()
+        print_summary()
+    print("Done")
+
+
+# Syncs the curated resources reachable through the connection pool to OSC
+def sync(args, config, pool):
     working_dir_prefix = args.working_dir
-    url = (
+    token = config["osc"]["token"]
+    url = config["osc"].get("url") or (
         "https://osc-dev.ucsd.edu/"
         if args.dev
         else "https://portal.opensciencechain.sdsc.edu/"
     )
-    for resource in resources:
+    workers = max(1, args.workers)
+    configure_session(
+        pool_size=max(workers, config["osc"].get("pool_size", 10)),
+        retries=config["osc"].get("retries"),
+        connect_timeout=config["osc"].get("connect_timeout"),
+        read_timeout=config["osc"].get("read_timeout"),
+        observer=observe_request,
+        adaptive=config["osc"].get("adaptive"),
+        initial_concurrency=config["osc"].get("initial_concurrency"),
+        max_read_concurrency=config["osc"].get("max_read_concurrency"),
+        max_write_concurrency=config["osc"].get("max_write_concurrency"),
+        max_read_rate=config["osc"].get("max_read_rate"),
+        max_write_rate=config["osc"].get("max_write_rate"),
+        compress=config["osc"].get("compress"),
+    )
+
+    configure_hashing(
+        cache_path=f"{working_dir_prefix}/hash_cache.sqlite",
+        verify=args.rehash,
+        on_stats=observe_hashing,
+        # the stats go to the metrics, not one report per resource
+        report=False,
+    )
+    configure_record_cache(
+        path=f"{working_dir_prefix}/record_cache.sqlite",
+        ttl=config["osc"].get("record_ttl"),
+    )
+
+    store = open_state_store(working_dir_prefix)
+    run, resumed = store.start_run()
+    if resumed:
+        print(f'Resuming the run started at {time.ctime(run["started_at"])}')
+    states = store.load_all()
+    reconcile_operations(store, states, url)
+    osc_id_writer = OscIdWriter(
+        pool,
+        config["db"].get("insert_batch_size", 100),
+        config["db"].get("insert_max_delay", 5.0),
+        on_flush=lambda rows: store.set_mapping_stored([rid for rid, _ in rows]),
+    )
+    recover_osc_ids(pool, states, osc_id_writer, store)
+    # without a previous run every resource is processed anyway
+    incremental = not args.full and any(
+        state["version"] is not None for state in states.values()
+    )
 
-        working_dir = f"{working_dir_prefix}/{resource['rid']}"
-        if not os.path.exists(working_dir):
-            os.makedirs(working_dir)
-        hash_filename = f"{working_dir}/manifest.txt"
+    context = {
+        "working_dir": working_dir_prefix,
+        "url": url,
+        "token": token,
+        "template": compile_template("./config/script_template.yaml"),
+        "debug_yaml": args.debug_yaml,
+        "store": store,
+    }
 
-        # check if OSC entry exists
-        if resource["rid"] not in osc_ids:
-            # Create new entry
+    resource_queue = queue.Queue(maxsize=workers * 4)
+    fetcher = threading.Thread(
+        target=fetch_resources,
+        args=(
+            pool,
+            resource_queue,
+            max(1, args.batch_size),
+            config["db"].get("chunk_size", DEFAULT_CHUNK_SIZE),
+            config["db"].get(
+                "latest_version_strategy", DEFAULT_LATEST_VERSION_STRATEGY
+            ),
+            states,
+            incremental,
+            run["started_at"] if resumed else None,
+            args.stream,
+        ),
+        daemon=True,
+    )
+    fetcher.start()
+
+    # At most 2 * workers resources are in flight, so a slow portal applies
+    # back-pressure to the DB stage through the bounded queue.
+    in_flight = {}
+    fetch_error = None
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
             try:
-                with open(hash_filename, "w+") as file:
-                    file.write(resource["hash"])
-                create_template_yaml(
-                    "./config/script_template.yaml",
-                    resource,
-                    hash_filename,
-                    f"{working_dir}/template.yaml",
-                    config["osc"]["token"],
-                )
-                template_file = open(f"{working_dir}/template.yaml")
-            except OSError:
-                print(
-                    f'Could not open/write manifest or template file for {resource["rid"]}'
-                )
+                item = resource_queue.get(timeout=0.5)
+            except queue.Empty:
+                done = [future for future in in_flight if future.done()]
+                store_results(store, osc_id_writer, in_flight, done)
                 continue
-            osc_id = contribute_data(
-                template_file, "", url, json_des_path=f"{working_dir}/"
-            )
-            template_file.close()
-            insert_osc_id(db_conn, resource["rid"], osc_id)
-        else:
-            # Check if hash has been changed
-            try:
-                hash_string = open(hash_filename, "r").readline()
-            except OSError:
-                print(f'Could not read manifest file for {resource["rid"]}')
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                fetch_error = item
                 continue
-            if hash_string != resource["hash"]:
-                # Update entry with new hash and other fields
-                with open(hash_filename, "w+") as file:
-                    file.write(resource["hash"])
-
-                current_work_dir = os.getcwd()
-                os.chdir(working_dir)
-                osc_id = osc_ids[resource["rid"]]
-                query_data(osc_id, "", url)
-                # create new template file based the one received from querying OSC
-                create_template_yaml(
-                    f"{osc_id}.yaml",
-                    resource,
-                    hash_filename,
-                    f"{osc_id}.yaml",
-                    config["osc"]["token"],
-                    update=True,
-                )
-                os.chdir(current_work_dir)
-                # Read template file and update OSC entry
-                try:
-                    generated_yaml = open(f"{working_dir}/{osc_id}.yaml")
-                except OSError:
-                    print("Could not open yaml file from OSC")
-                    continue
-                update_data(
-                    generated_yaml,
-                    None,
-                    url,
-                    json_result_prefix_path=f"{working_dir}/",
-                )
-    if args.tunnel:
-        ssh_tunnel.stop()
-    print("Done")
+            resource, osc_id, last_hash = item
+            future = executor.submit(
+                sync_resource, resource, osc_id, last_hash, context
+            )
+            in_flight[future] = resource
+            if len(in_flight) >= workers * 2:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                store_results(store, osc_id_writer, in_flight, done)
+        done, _ = wait(in_flight)
+        store_results(store, osc_id_writer, in_flight, done)
+    fetcher.join()
+    if limits():
+        print(
+            "OSC concurrency limits: "
+            + ", ".join(f"{kind} {limit}" for kind, limit in sorted(limits().items()))
+        )
+    record_cache = get_record_cache()
+    if record_cache is not None:
+        print(record_cache)
+        count("record_cache", record_cache.hits, result="hit")
+        count("record_cache", record_cache.revalidated, result="revalidated")
+        count("record_cache", record_cache.misses, result="miss")
+    bodies = body_stats()
+    if bodies["bodies"] > 0:
+        print(format_body_stats(bodies))
+        count("request_body_bytes", bodies["json_bytes"], encoding="identity")
+        count("request_body_bytes", bodies["sent_bytes"], encoding="sent")
+    osc_id_writer.flush()
+    if fetch_error is None:
+        store.finish_run(run)
+    store.close()
+
+    if fetch_error is not None:
+        raise fetch_error
 
 
-main()
+if __name__ == "__main__":
+    main()
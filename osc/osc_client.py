@@ -1,24 +1,26 @@
 #!/usr/bin/env python3
 
 import argparse
-import glob
 import hashlib
 import json
 import os
+import stat
 import sys
+import threading
 from argparse import RawTextHelpFormatter
+from collections import deque
 from urllib.parse import urlparse
 
-import requests
-import yaml
+from osc import osc_session
+from osc.osc_diff import ManifestDiff
+from osc.osc_hash import MANIFEST_ALGORITHM, configure_hashing, iter_hash_files
+from osc.osc_manifest import Manifest, configure_manifest
 from osc.osc_utils import print_summary, save_query_result, update_summary
+from osc.osc_walk import ExcludeMatcher, walk_files
 
-#####################################################
-from urllib3.exceptions import InsecureRequestWarning
-
-# Suppress only the single warning from urllib3 needed.
-requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
-#####################################################
+# requests, yaml and the SQLite record cache are imported by the functions
+# that use them, so --help and argument errors do not pay for them and a
+# query does not load yaml or the cache
 
 
 URL = "https://portal.opensciencechain.sdsc.edu/"
@@ -26,6 +28,55 @@ URL = "https://portal.opensciencechain.sdsc.edu/"
 DATA = "api/data/"
 SEARCH = "api/search/"
 
+# keys a contribute / update response must have to be cached as the record,
+# i.e. to be usable as the base of the next update
+RECORD_KEYS = ("id", "docType", "manifest", "fundingAgencies")
+
+record_cache_settings = {
+    # records are cached in this file when it is set
+    "path": None,
+    # seconds a cached record is used without asking the portal
+    "ttl": 86400,
+    "max_entries": 100000,
+}
+
+_record_cache = None
+_record_cache_lock = threading.Lock()
+
+
+def configure_record_cache(**kwargs):
+    global _record_cache
+    for k, v in kwargs.items():
+        if k not in record_cache_settings:
+            raise ValueError(f"Unknown record cache setting '{k}'")
+        if v is not None:
+            record_cache_settings[k] = v
+    with _record_cache_lock:
+        if _record_cache is not None:
+            _record_cache.close()
+            _record_cache = None
+
+
+def get_record_cache():
+    global _record_cache
+    with _record_cache_lock:
+        if _record_cache is None and record_cache_settings["path"]:
+            from osc.osc_record_cache import RecordCache
+
+            _record_cache = RecordCache(
+                record_cache_settings["path"],
+                record_cache_settings["ttl"],
+                record_cache_settings["max_entries"],
+            )
+        return _record_cache
+
+
+# Caches a contribute / update response as the current record of its id
+def cache_response(res_json, osc_url):
+    cache = get_record_cache()
+    if cache is not None and all(k in res_json for k in RECORD_KEYS):
+        cache.store(osc_url + DATA + res_json["id"], res_json)
+
 
 # use this regular expression? /^10.\d{4,9}/[-._;()/:A-Z0-9]+$/i
 def validate_doi(doi):
@@ -56,7 +107,7 @@ def validate_fields(action, data):
     res = 0
 
     # check if at least on file is present
-    if data["manifest"] == []:
+    if len(data["manifest"]) == 0:
         print("At least one file should be present for the '", action, "' action")
         return -1
 
@@ -94,49 +145,85 @@ def map_headers():
     return hlist1, hlist2
 
 
-# returns a list of all files to be hashed
-# returns NULL if no files are directories are present
-def get_all_files(data):
-    all_files = set()
-
-    if data["Files"] and (data["Files"] != ""):
-        f1 = data["Files"]
-        all_files = {f for f in f1}
-    dir = data["Directories"]
-    if data["Directories"] and (data["Directories"] != ""):
-        for d in dir:
-            all_files.update([f for f in glob.glob(d + "/**", recursive=True)])
+# yields (path, stat_result) for all files to be hashed, the listed Files
+# first and then the files found under Directories. A listed file that cannot
+# be stat'ed comes with None. Excluded directories are not walked, and a
+# directory inside another listed one is only walked as part of it.
+def iter_all_files(data):
+    exclude = ExcludeMatcher(data["ExcludeList"] or ())
+    listed = set()
 
-    # remove the files from the exclude list
-    # final_file_list = []
-    ex_file_list = []
-    if data["ExcludeList"] and (data["ExcludeList"] != ""):
-        xl = data["ExcludeList"]
-        for f in xl:
-            if os.path.isfile(f):
-                ex_file_list.append(f)
-            elif os.path.isdir(f):
-                ex_file_list.extend([fl for fl in glob.glob(f + "/**", recursive=True)])
+    for f in data["Files"] or ():
+        if f in listed or exclude.excludes(f):
+            continue
+        listed.add(f)
+        try:
+            yield f, os.stat(f)
+        except OSError:
+            yield f, None
 
-    # assuming exclude list is a lot smaller than the actual file list. If not we need
-    # to modify the way we search for an element to improve performance
-    for f in ex_file_list:
-        if f in all_files:
-            all_files.remove(f)
+    dirs = list(data["Directories"] or ())
+    for i, d in enumerate(dirs):
+        if any(d.rstrip("/") == other.rstrip("/") for other in dirs[:i]):
+            continue
+        if any(is_walked_by(d, other) for other in dirs):
+            continue
+        for path, st in walk_files(d, exclude):
+            if path not in listed:
+                yield path, st
+
+
+# whether the walk of root yields every file of d, with the same path
+def is_walked_by(d, root):
+    d = d.rstrip("/")
+    root = root.rstrip("/")
+    if not d.startswith(root + "/"):
+        return False
+    # hidden directories are skipped by the walk
+    return not any(part.startswith(".") for part in d[len(root) + 1 :].split("/"))
+
+
+def iter_valid_files(files):
+    for f, st in files:
+        if st is not None and stat.S_ISREG(st.st_mode):
+            yield f, st
+        elif st is not None and stat.S_ISDIR(st.st_mode):
+            continue
+        else:
+            print(os.getcwd())
+            print("'", f, "' is not a valid file.")
 
-    #  print ("***********************************")
-    #  print(ex_file_list_dict)
-    #  print ("***********************************")
 
-    #  print(final_file_list)
-    #  print ("***********************************")
+def load_template(f):
+    import yaml
 
-    return all_files
+    return yaml.load(f, Loader=yaml.FullLoader)
 
 
 def get_json_data(f, cli_tok, action):
-    data = yaml.load(f, Loader=yaml.FullLoader)
+    return build_json_data(load_template(f), cli_tok, action)
+
+
+# Same as get_json_data for a template that is already loaded as a dict.
+# For an update, the change report is written to
+# {report_prefix}changes-{id}.json unless report_prefix is None.
+def build_json_data(data, cli_tok, action, report_prefix="", keep_unchanged=False):
+    json_data, tok = build_payload(data, cli_tok, action, report_prefix, keep_unchanged)
+    manifest = json_data["manifest"]
+    try:
+        json_data["manifest"] = [
+            {"filename": path, "hash": digest.hex(), "algorithm": manifest.algorithm}
+            for path, digest in manifest
+        ]
+    finally:
+        manifest.close()
+    return json_data, tok
 
+
+# Same as build_json_data, but json_data["manifest"] is an
+# osc_manifest.Manifest that is only written out as the request body is
+# encoded. The caller must close it.
+def build_payload(data, cli_tok, action, report_prefix="", keep_unchanged=False):
     tok = cli_tok
     if tok == "" or tok is None:
         tok = data["Token"]
@@ -144,7 +231,6 @@ def get_json_data(f, cli_tok, action):
         print("Please submit a valid token")
         sys.exit(-1)
 
-    files = get_all_files(data)
     json_data = {}
     hlist1, hlist2 = map_headers()
 
@@ -200,76 +286,72 @@ def get_json_data(f, cli_tok, action):
                 funding_list.append(k)
 
     json_data["fundingSupport"] = funding_list
-    manifest_list = []
+    manifest = Manifest(MANIFEST_ALGORITHM, hashlib.new(MANIFEST_ALGORITHM).digest_size)
 
     # need for update operation
     if action == "update":
-        new_files = set()
-        updated_files = set()
-        old_files = set()
-        deleted_files = set()
-
-    for f in files:
-        sha256_hash = hashlib.sha256()
-        if os.path.isfile(f):
-            d = {"filename": f}
-        elif os.path.isdir(f):
-            continue
-        else:
-            print(os.getcwd())
-            print("'", f, "' is not a valid file.")
-            continue
-
-        with open(f, "rb") as fin:
-            # Read and update hash string value in blocks of 4K
-            for byte_block in iter(lambda: fin.read(4096), b""):
-                sha256_hash.update(byte_block)
-            d["hash"] = sha256_hash.hexdigest()
-            d["algorithm"] = "sha256"
-            manifest_list.append(d)
-            fin.close()
+        diff = ManifestDiff(orig_file_list, keep_unchanged)
 
+    # the files are walked, hashed and added to the manifest a batch at a time
+    valid_files = iter_valid_files(iter_all_files(data))
+    for f, digests in iter_hash_files(valid_files):
+        hash = digests[MANIFEST_ALGORITHM]
+        manifest.add(f, bytes.fromhex(hash))
         if action == "update":
-            if orig_file_list.get(f) is None:
-                new_files.add(f)
-            elif orig_file_list[f] == d["hash"]:
-                old_files.add(f)
-            elif orig_file_list[f] != d["hash"]:
-                updated_files.add(f)
-
-            deleted_files = orig_file_list.keys() - (
-                new_files | old_files | updated_files
-            )
+            diff.add(f, hash)
 
-    #       print(sha256_hash.hexdigest())
-
-    json_data["manifest"] = manifest_list
+    json_data["manifest"] = manifest
 
     if action == "update":
-        update_summary(
-            new_files, old_files, updated_files, deleted_files, json_data["id"]
-        )
+        update_summary(diff.finish(), json_data["id"], report_prefix)
 
     return json_data, tok
 
 
+# Validates the payload of build_payload and sends it, POST for a
+# contribution and PUT for an update. Returns the response or -1. The
+# manifest of the payload is closed once the request is sent.
+def send_payload(action, json_data, tok, osc_url):
+    import requests
+
+    try:
+        res = validate_fields(action, json_data)
+        if res == -1:
+            print("Please correct the errors and resubmit")
+            return -1
+        url = osc_url + DATA
+        h = {
+            "accept": "application/json",
+            "Content-Type": "application/json",
+            "authorization": "Bearer " + tok,
+        }
+        send = osc_session.post_json if action == "contribute" else osc_session.put_json
+        try:
+            return send(url, json_data, headers=h, verify=False)
+        except requests.exceptions.RequestException as err:
+            print("Error: " + str(err))
+            return -1
+    finally:
+        json_data["manifest"].close()
+
+
 # contribute data
-def contribute_data(f, cli_tok, osc_url, json_des_path=""):
+# With json_des_path=None the response is not written to disk; it can still
+# be collected through result_callback.
+def contribute_data(f, cli_tok, osc_url, json_des_path="", result_callback=None):
+    return contribute_record(
+        load_template(f), cli_tok, osc_url, json_des_path, result_callback
+    )
+
 
-    json_data, tok = get_json_data(f, cli_tok, "contribute")
-    res = validate_fields("contribute", json_data)
+# contribute data from a template dict
+def contribute_record(data, cli_tok, osc_url, json_des_path="", result_callback=None):
+    import requests
+
+    json_data, tok = build_payload(data, cli_tok, "contribute")
+    res = send_payload("contribute", json_data, tok, osc_url)
     if res == -1:
-        print("Please correct the errors and resubmit")
         return -1
-    out = json.dumps(json_data)
-
-    url = osc_url + DATA
-    h = {
-        "accept": "application/json",
-        "Content-Type": "application/json",
-        "authorization": "Bearer " + tok,
-    }
-    res = requests.post(url, data=out, headers=h, verify=False)
 
     if res.status_code != requests.codes.ok:
         print("Error: " + res.text)
@@ -283,25 +365,46 @@ def contribute_data(f, cli_tok, osc_url, json_des_path=""):
         return -1
     else:
         print("Your osc-id is " + res_json["id"])
-        print("A copy of your contribution is stored as " + res_json["id"] + ".json")
-        dest_path = f"{json_des_path}{res_json['id']}.json"
-        with open(dest_path, "w") as fout:
-            json.dump(res_json, fout)
+        if json_des_path is not None:
+            print(
+                "A copy of your contribution is stored as " + res_json["id"] + ".json"
+            )
+            dest_path = f"{json_des_path}{res_json['id']}.json"
+            with open(dest_path, "w") as fout:
+                json.dump(res_json, fout)
+        cache_response(res_json, osc_url)
+        if result_callback is not None:
+            result_callback(res_json)
         return res_json["id"]
 
 
-# at present token is not used for search
-def search_data(id, tok, osc_url):
+# returns the summaries of the records matching term, or -1
+# errors are printed to err, stdout if None
+def search_records(term, osc_url, err=None):
+    import requests
+
     url = osc_url + SEARCH
-    obj = {"search": id}
+    obj = {"search": term}
     out = json.dumps(obj)
     h = {"accept": "application/json", "Content-Type": "application/json"}
-    #  res = requests.post(url, data=out, headers=h, verify=False)
-    res = requests.post(url, data=out, headers=h, verify=True)
+    try:
+        res = osc_session.post(
+            url, idempotent=True, kind="read", data=out, headers=h, verify=True
+        )
+    except requests.exceptions.RequestException as exc:
+        print("Error: " + str(exc), file=err)
+        return -1
     if res.status_code != requests.codes.ok:
-        print("Error: " + res.text)
+        print("Error: " + res.text, file=err)
+        return -1
+    return res.json()
+
+
+# at present token is not used for search
+def search_data(id, tok, osc_url):
+    res_json = search_records(id, osc_url)
+    if res_json == -1:
         return -1
-    res_json = res.json()
     if len(res_json) == 0:
         print("Empty")
     else:
@@ -311,7 +414,7 @@ def search_data(id, tok, osc_url):
             print("Saving the query results in yaml format, one file per matched entry")
             for i in range(0, len(res_json)):
                 query_data(
-                    res_json[i]["id"], ""
+                    res_json[i]["id"], "", osc_url
                 )  # Search doesn't get all the fields, so need to query again based on osc-id.
             sys.exit(-1)
 
@@ -319,7 +422,7 @@ def search_data(id, tok, osc_url):
             print_summary(res_json[i])
             inp = input("Do you want to save this entry (Y/N): ")
             if inp.lower() == "y":
-                query_data(res_json[i]["id"], "")
+                query_data(res_json[i]["id"], "", osc_url)
 
             if i == len(res_json) - 1:
                 break
@@ -330,50 +433,190 @@ def search_data(id, tok, osc_url):
 
 
 # at present token is not used for query
-def query_data(id, tok, osc_url):
+def query_data(id, tok, osc_url, yaml_dest_path=""):
+    res_json = fetch_record(id, osc_url)
+    if res_json == -1:
+        return -1
+    print("A copy of data from your query is stored as " + res_json["id"] + ".yaml")
+    print(
+        "This file should be used to update / modify the contributed dataset if you were the contributor."
+    )
+    save_query_result(res_json, yaml_dest_path)
+
+
+# returns the OSC record as a dict, or -1. With a record cache, a fresh
+# cached record is returned without a request and a stale one is revalidated
+# with a conditional GET. Errors are printed to err, stdout if None.
+def fetch_record(id, osc_url, err=None):
+    import requests
+
     url = osc_url + DATA + id
+    cache = get_record_cache()
+    entry = cache.lookup(url) if cache is not None else None
+    if entry is not None and entry["fresh"]:
+        return entry["record"]
     h = {"accept": "application/json", "Content-Type": "application/json"}
-    res = requests.get(url, headers=h, verify=False)
-    # res = requests.get(url, headers=h, verify=True)
+    if entry is not None:
+        if entry["etag"]:
+            h["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            h["If-Modified-Since"] = entry["last_modified"]
+    try:
+        res = osc_session.get(url, headers=h, verify=False)
+    except requests.exceptions.RequestException as exc:
+        print("Error: " + str(exc), file=err)
+        return -1
+    if res.status_code == requests.codes.not_modified and entry is not None:
+        cache.mark_revalidated(url)
+        return entry["record"]
     if res.status_code != requests.codes.ok:
-        print("Error: " + res.text)
+        print("Error: " + res.text, file=err)
         return -1
     res_json_tmp = res.json()
     res_json = json.loads(res_json_tmp[0])
     if res_json["docType"] == "org.osc.Error":
-        print("Error: " + res_json["info"])
-    else:
-        print("A copy of data from your query is stored as " + res_json["id"] + ".yaml")
-        print(
-            "This file should be used to update / modify the contributed dataset if you were the contributor."
+        print("Error: " + res_json["info"], file=err)
+        if entry is not None:
+            cache.invalidate(url)
+        return -1
+    if cache is not None:
+        cache.store(
+            url,
+            res_json,
+            res.headers.get("ETag"),
+            res.headers.get("Last-Modified"),
+            miss=entry is not None,
         )
-        save_query_result(res_json)
+    return res_json
+
+
+def format_record(record, fmt):
+    if fmt == "jsonl":
+        return json.dumps(record) + "\n"
+    if fmt == "yaml":
+        import yaml
+
+        # libyaml dumper when PyYAML was built with it
+        dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+        return yaml.dump(record, Dumper=dumper, explicit_start=True, sort_keys=False)
+    raise ValueError(f"Unknown export format '{fmt}'")
+
+
+# Writes the full records of ids, or of every record matching term, to output
+# (a path, "-" for stdout or a file object) as JSON lines (fmt "jsonl") or as
+# a multi-document YAML stream (fmt "yaml"), in the order of ids. Up to
+# workers records are fetched concurrently. Progress goes to stderr every
+# progress_every records (never if 0), and so do errors when the records are
+# written to stdout.
+# Returns the number of records written and the list of ids that could not
+# be fetched, or -1 if the search failed.
+def export_records(
+    osc_url,
+    output,
+    ids=None,
+    term=None,
+    fmt="jsonl",
+    workers=8,
+    progress_every=100,
+):
+    from concurrent.futures import ThreadPoolExecutor
+
+    format_record({}, fmt)
+    err = sys.stderr if output == "-" or output is sys.stdout else None
+    if ids is None:
+        summaries = search_records(term, osc_url, err)
+        if summaries == -1:
+            return -1
+        ids = [summary["id"] for summary in summaries]
+    ids = list(ids)
+
+    if output == "-":
+        fout = sys.stdout
+    elif isinstance(output, str):
+        fout = open(output, "w")
+    else:
+        fout = output
+    written = 0
+    failed = []
+
+    def write_next():
+        nonlocal written
+        id, future = pending.popleft()
+        record = future.result()
+        if record == -1:
+            failed.append(id)
+        else:
+            fout.write(format_record(record, fmt))
+            written += 1
+        done = written + len(failed)
+        if progress_every and (done % progress_every == 0 or done == len(ids)):
+            print(
+                "Exported {}/{} records, {} failed".format(
+                    written, len(ids), len(failed)
+                ),
+                file=sys.stderr,
+            )
+
+    # at most 2 * workers fetched records wait for their turn in memory
+    pending = deque()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for id in ids:
+                pending.append((id, executor.submit(fetch_record, id, osc_url, err)))
+                if len(pending) >= workers * 2:
+                    write_next()
+            while pending:
+                write_next()
+    finally:
+        if fout is output or fout is sys.stdout:
+            fout.flush()
+        else:
+            fout.close()
+    return written, failed
 
 
 # update data. We are assuming that there is a json file with the contributed
 # data. This function will first load the json file, convert into an yaml
 # template.
 # ToDo: Next user will have to update this template and "resubmit it"
-def update_data(f, cli_tok, osc_url, json_result_prefix_path=""):
-    json_data, tok = get_json_data(f, cli_tok, "update")
-    ######################################################
-    res = validate_fields("update", json_data)
-    ######################################################
+def update_data(
+    f,
+    cli_tok,
+    osc_url,
+    json_result_prefix_path="",
+    result_callback=None,
+    keep_unchanged=False,
+):
+    return update_record(
+        load_template(f),
+        cli_tok,
+        osc_url,
+        json_result_prefix_path,
+        result_callback,
+        keep_unchanged,
+    )
+
+
+# update data from a template dict, e.g. one built from a queried record with
+# osc_utils.record_to_template, without going through a yaml file. The change
+# report is written next to the response, i.e. not at all if
+# json_result_prefix_path is None.
+def update_record(
+    data,
+    cli_tok,
+    osc_url,
+    json_result_prefix_path="",
+    result_callback=None,
+    keep_unchanged=False,
+):
+    import requests
+
+    json_data, tok = build_payload(
+        data, cli_tok, "update", json_result_prefix_path, keep_unchanged
+    )
+    res = send_payload("update", json_data, tok, osc_url)
     if res == -1:
-        print("Please correct the errors and resubmit")
         return -1
-    out = json.dumps(json_data)
-
-    ################
-    url = osc_url + DATA
-    #  h = {'accept': 'application/json', 'Content-Type': 'application/json', 'authorization':'Bearer ' + data['Token']}
-    h = {
-        "accept": "application/json",
-        "Content-Type": "application/json",
-        "authorization": "Bearer " + tok,
-    }
-    res = requests.put(url, data=out, headers=h, verify=False)
-    #  res = requests.put(url, data=out, headers=h, verify=True)
 
     if res.status_code != requests.codes.ok:
         print("Error: " + res.text)
@@ -382,14 +625,23 @@ def update_data(f, cli_tok, osc_url, json_result_prefix_path=""):
     #  print (res_json)
     if res_json["docType"] == "org.osc.Error":
         print("Error: " + res_json["error_message"])
+        return -1
     elif res_json["docType"] == "org.osc.AuthenticationFailed":
         print("Error: Authentication Failed. Please check your token.")
+        return -1
     else:
         print("Your osc-id is " + res_json["id"])
-        print("A copy of your contribution is stored as " + res_json["id"] + ".json")
-        json_path = f"{json_result_prefix_path}{res_json['id']}.json"
-        with open(json_path, "w") as fout:
-            json.dump(res_json, fout)
+        if json_result_prefix_path is not None:
+            print(
+                "A copy of your contribution is stored as " + res_json["id"] + ".json"
+            )
+            json_path = f"{json_result_prefix_path}{res_json['id']}.json"
+            with open(json_path, "w") as fout:
+                json.dump(res_json, fout)
+        cache_response(res_json, osc_url)
+        if result_callback is not None:
+            result_callback(res_json)
+        return res_json["id"]
     ################
 
 
@@ -397,8 +649,9 @@ def main():
     parser = argparse.ArgumentParser(formatter_class=RawTextHelpFormatter)
     parser.add_argument(
         "operation",
-        help="""'contribute', 'query' or 'update'.\n
-        For update, first perform a query and then modify the saved yaml file.""",
+        help="""'contribute', 'query', 'update' or 'export'.\n
+        For update, first perform a query and then modify the saved yaml file.\n
+        export writes many records to a single file without prompting.""",
     )
     parser.add_argument(
         "--template",
@@ -410,6 +663,32 @@ def main():
     parser.add_argument(
         "--email", help="osc-id or email-id is required for the query operation"
     )
+    parser.add_argument(
+        "--search",
+        help="search term selecting the records of the export operation",
+    )
+    parser.add_argument(
+        "--ids_file",
+        help="file with one osc-id per line ('-' for stdin) for the export operation",
+    )
+    parser.add_argument(
+        "--output",
+        help="output file of the export operation ('-' for stdout).\n"
+        "Default is osc-export.jsonl or osc-export.yaml",
+    )
+    parser.add_argument(
+        "--format",
+        choices=("jsonl", "yaml"),
+        default="jsonl",
+        help="'jsonl' (one record per line) or 'yaml' (one document per record)\n"
+        "for the export operation",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="number of records fetched concurrently by the export operation",
+    )
     parser.add_argument(
         "--token",
         help="""pass the authorization key obtained from the OSC Portal.\n
@@ -419,12 +698,84 @@ def main():
         "--env",
         help="use the value 'dev' for the development environment. Default is the production environment.",
     )
+    parser.add_argument(
+        "--url",
+        help="URL of the OSC Portal, e.g. a local stub. Overrides --env",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        help="read timeout in seconds for each request to the OSC Portal",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        help="number of times a request failing with a transient error is retried",
+    )
+    parser.add_argument(
+        "--compress",
+        choices=("gzip", "deflate"),
+        help="compress the request body of contribute and update operations.\n"
+        "It is sent uncompressed if the portal rejects it",
+    )
+    parser.add_argument(
+        "--hash_workers",
+        type=int,
+        help="number of processes used to hash the files of a contribution",
+    )
+    parser.add_argument(
+        "--hash_cache",
+        help="path of a file hash cache. Files unchanged since they were last\n"
+        "hashed (same size, mtime and inode) are not read again",
+    )
+    parser.add_argument(
+        "--rehash",
+        action="store_true",
+        help="rehash every file even if it is found in the hash cache",
+    )
+    parser.add_argument(
+        "--record_cache",
+        help="path of an OSC record cache. Updates start from the cached record\n"
+        "instead of querying the portal for it",
+    )
+    parser.add_argument(
+        "--record_ttl",
+        type=float,
+        help="seconds a cached record is used before it is revalidated with the portal",
+    )
+    parser.add_argument(
+        "--spill_threshold",
+        type=int,
+        help="number of manifest entries kept in memory before the manifest is\n"
+        "moved to a temporary file, 0 to keep it in memory",
+    )
+    parser.add_argument(
+        "--spill_dir",
+        help="directory of the temporary manifest files",
+    )
+    parser.add_argument(
+        "--list_unchanged",
+        action="store_true",
+        help="also list the unchanged files in the change report of an update",
+    )
     parser.add_argument("--version", action="version", version="%(prog)s 1.0.0")
 
     args = parser.parse_args()
+    osc_session.configure_session(
+        read_timeout=args.timeout, retries=args.retries, compress=args.compress
+    )
+    configure_hashing(
+        workers=args.hash_workers,
+        cache_path=args.hash_cache,
+        verify=args.rehash,
+    )
+    configure_record_cache(path=args.record_cache, ttl=args.record_ttl)
+    configure_manifest(spill_threshold=args.spill_threshold, spill_dir=args.spill_dir)
     url = "https://portal.opensciencechain.sdsc.edu/"
     if args.env == "dev":
         url = "https://osc-dev.ucsd.edu/"
+    if args.url:
+        url = args.url
 
     if args.operation == "contribute":
         if args.template is None:
@@ -441,6 +792,8 @@ def main():
             print(msg)
             sys.exit(-1)
         contribute_data(f, args.token, url)
+        if args.compress:
+            print(osc_session.format_body_stats(osc_session.body_stats()))
     elif args.operation == "update":
         if args.template is None:
             print(
@@ -456,7 +809,9 @@ def main():
             msg = "Error: File '{}' not found.".format(args.template)
             print(msg)
             sys.exit(-1)
-        update_data(f, args.token, url)
+        update_data(f, args.token, url, keep_unchanged=args.list_unchanged)
+        if args.compress:
+            print(osc_session.format_body_stats(osc_session.body_stats()))
     elif args.operation == "query":
         if (args.oscid is None) and (args.email is None):
             print(
@@ -478,6 +833,29 @@ def main():
             query_data(oscid, args.token, url)
         elif args.email is not None:
             search_data(args.email, args.token, url)
+    elif args.operation == "export":
+        term = args.search or args.email
+        ids = None
+        if args.ids_file is not None:
+            try:
+                fin = sys.stdin if args.ids_file == "-" else open(args.ids_file)
+            except FileNotFoundError:
+                print("Error: File '{}' not found.".format(args.ids_file))
+                sys.exit(-1)
+            ids = [line.strip() for line in fin if line.strip()]
+        elif args.oscid is not None:
+            ids = [id.strip() for id in args.oscid.split(",") if id.strip()]
+        elif term is None:
+            print(
+                "'{}' operation requires osc-ids (--oscid, --ids_file) or a search term".format(
+                    args.operation
+                )
+            )
+            sys.exit(-1)
+        output = args.output or "osc-export." + args.format
+        res = export_records(url, output, ids, term, args.format, max(1, args.workers))
+        if res == -1 or res[1]:
+            sys.exit(-1)
     else:
         msg = "'{}' operation is not supported".format(args.operation)
         print(msg)
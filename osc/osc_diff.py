@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+# Diff of the manifest of an update against the contributed one, in a single
+# pass over the new files. Only the names of new, updated and deleted files
+# (and of the unchanged ones if asked) are kept, besides the counts. The
+# contributed manifest shrinks as its files are matched.
+
+
+class ManifestDiff:
+    # old maps the contributed file names to their hash, it is consumed
+    def __init__(self, old, keep_unchanged=False):
+        self.old = old
+        self.keep_unchanged = keep_unchanged
+        self.new = []
+        self.updated = []
+        self.unchanged = []
+        self.deleted = []
+        self.unchanged_count = 0
+
+    # Classifies one file of the new manifest, every file is added once
+    def add(self, filename, hash):
+        old_hash = self.old.pop(filename, None)
+        if old_hash is None:
+            self.new.append(filename)
+        elif old_hash == hash:
+            self.unchanged_count += 1
+            if self.keep_unchanged:
+                self.unchanged.append(filename)
+        else:
+            self.updated.append(filename)
+
+    # The old files that were not added are deleted
+    def finish(self):
+        self.deleted = list(self.old)
+        self.old.clear()
+        return self
+
+    def counts(self):
+        return {
+            "new": len(self.new),
+            "updated": len(self.updated),
+            "unchanged": self.unchanged_count,
+            "deleted": len(self.deleted),
+        }
+
+    def report(self):
+        report = {
+            "counts": self.counts(),
+            "new": self.new,
+            "updated": self.updated,
+            "deleted": self.deleted,
+        }
+        if self.keep_unchanged:
+            report["unchanged"] = self.unchanged
+        return report
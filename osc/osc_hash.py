@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+import hashlib
+import mmap
+import os
+import threading
+import time
+from functools import partial
+from itertools import islice
+
+# File hashing engine used to build contribution manifests. Files are spread
+# over a process pool, read with a large reusable buffer (or mmap) and every
+# requested digest is computed in the same pass over the data. The process
+# pool and the hash cache are imported when they are first needed.
+
+MANIFEST_ALGORITHM = "sha256"
+
+settings = {
+    "workers": os.cpu_count() or 1,
+    "block_size": 1 << 20,
+    "use_mmap": False,
+    # number of files looked up, hashed and yielded at a time
+    "batch_size": 4096,
+    "report": True,
+    # digests of unchanged files are reused from this cache when it is set
+    "cache_path": None,
+    "cache_max_entries": 1000000,
+    # rehash every file even if the cache has an entry for it
+    "verify": False,
+    # called with the HashStats of every iter_hash_files call
+    "on_stats": None,
+}
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def configure_hashing(**kwargs):
+    global _cache
+    for k, v in kwargs.items():
+        if k not in settings:
+            raise ValueError(f"Unknown hashing setting '{k}'")
+        if v is not None:
+            settings[k] = v
+    with _cache_lock:
+        if _cache is not None and (
+            _cache.path != settings["cache_path"]
+            or _cache.max_entries != settings["cache_max_entries"]
+        ):
+            _cache.close()
+            _cache = None
+
+
+def get_hash_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None and settings["cache_path"]:
+            from osc.osc_hash_cache import HashCache
+
+            _cache = HashCache(settings["cache_path"], settings["cache_max_entries"])
+        return _cache
+
+
+class HashStats:
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.cached = 0
+
+    def bytes_per_sec(self):
+        if self.seconds <= 0:
+            return 0.0
+        return self.bytes / self.seconds
+
+    def __str__(self):
+        return "Hashed {} files ({:.1f} MB) at {:.1f} MB/s, {} from cache".format(
+            self.files, self.bytes / 1e6, self.bytes_per_sec() / 1e6, self.cached
+        )
+
+
+def _update_all(hashes, chunk):
+    for h in hashes:
+        h.update(chunk)
+
+
+def hash_file(
+    path, algorithms=(MANIFEST_ALGORITHM,), block_size=1 << 20, use_mmap=False
+):
+    hashes = [hashlib.new(a) for a in algorithms]
+    size = 0
+    with open(path, "rb", buffering=0) as fin:
+        if use_mmap and os.fstat(fin.fileno()).st_size > 0:
+            with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                view = memoryview(mm)
+                for start in range(0, len(mm), block_size):
+                    _update_all(hashes, view[start : start + block_size])
+                size = len(mm)
+                view.release()
+        else:
+            buf = bytearray(block_size)
+            view = memoryview(buf)
+            while True:
+                n = fin.readinto(buf)
+                if not n:
+                    break
+                _update_all(hashes, view[:n])
+                size += n
+    return path, {a: h.hexdigest() for a, h in zip(algorithms, hashes)}, size
+
+
+# Yields (path, {algorithm: hexdigest}) for every (path, stat_result or None)
+# of entries, in order. Entries are consumed batch_size at a time, so only a
+# batch of paths and digests is held in memory. stats, if given, is filled as
+# the files are hashed.
+def iter_hash_files(entries, algorithms=None, workers=None, stats=None):
+    if algorithms is None:
+        algorithms = (MANIFEST_ALGORITHM,)
+    if workers is None:
+        workers = settings["workers"]
+    algorithms = tuple(algorithms)
+    entries = iter(entries)
+    if stats is None:
+        stats = HashStats()
+    job = partial(
+        hash_file,
+        algorithms=algorithms,
+        block_size=settings["block_size"],
+        use_mmap=settings["use_mmap"],
+    )
+    cache = get_hash_cache()
+    pool = None
+    try:
+        batch = list(islice(entries, settings["batch_size"]))
+        while batch:
+            digests = {}
+            to_hash = []
+            if cache is None:
+                to_hash = [path for path, _ in batch]
+            else:
+                stat_results = {}
+                hit_paths = []
+                for path, st in batch:
+                    if st is None:
+                        st = os.stat(path)
+                    stat_results[path] = st
+                    cached = None
+                    if not settings["verify"]:
+                        cached = cache.lookup(path, st, algorithms)
+                    if cached is None:
+                        to_hash.append(path)
+                    else:
+                        digests[path] = {a: cached[a] for a in algorithms}
+                        hit_paths.append(path)
+                stats.cached += len(hit_paths)
+                cache.touch(hit_paths)
+
+            start = time.perf_counter()
+            if workers <= 1 or len(to_hash) < 2:
+                results = map(job, to_hash)
+            else:
+                if pool is None:
+                    from concurrent.futures import ProcessPoolExecutor
+
+                    pool = ProcessPoolExecutor(max_workers=workers)
+                chunksize = max(1, len(to_hash) // (workers * 8))
+                results = pool.map(job, to_hash, chunksize=chunksize)
+            for path, file_digests, size in results:
+                digests[path] = file_digests
+                stats.files += 1
+                stats.bytes += size
+            stats.seconds += time.perf_counter() - start
+            if cache is not None:
+                cache.store([(p, stat_results[p], digests[p]) for p in to_hash])
+                cache.commit()
+
+            for path, _ in batch:
+                yield path, digests[path]
+            batch = list(islice(entries, settings["batch_size"]))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    if settings["on_stats"] is not None:
+        settings["on_stats"](stats)
+    if settings["report"] and (stats.files > 0 or stats.cached > 0):
+        print(stats)
+        if cache is not None:
+            print(cache)
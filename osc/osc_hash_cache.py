@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import json
+import time
+
+from osc.osc_sqlite_cache import SqliteLruCache
+
+# On-disk cache of file digests keyed by (path, size, mtime_ns, inode). A file
+# whose stat key matches the cached one is not read again. The cache is a
+# single SQLite file, so it can be shared by several runs and resources.
+
+create_table_query = """CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    digests TEXT NOT NULL,
+    last_used REAL NOT NULL
+)"""
+
+lookup_query = """SELECT size, mtime_ns, inode, digests
+FROM file_hashes
+WHERE path = ?"""
+
+store_query = """INSERT OR REPLACE INTO file_hashes
+    (path, size, mtime_ns, inode, digests, last_used)
+VALUES (?, ?, ?, ?, ?, ?)"""
+
+touch_query = "UPDATE file_hashes SET last_used = ? WHERE path = ?"
+
+
+def stat_key(st):
+    return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+class HashCache(SqliteLruCache):
+    def __init__(self, path, max_entries=1000000):
+        super().__init__(path, "file_hashes", "path", create_table_query, max_entries)
+        self.hits = 0
+        self.misses = 0
+
+    # Returns the cached digests if the file has not changed and all the
+    # requested algorithms are present, None otherwise.
+    def lookup(self, path, st, algorithms):
+        with self._lock:
+            row = self._conn.execute(lookup_query, (path,)).fetchone()
+            if row is not None and tuple(row[:3]) == stat_key(st):
+                digests = json.loads(row[3])
+                if all(a in digests for a in algorithms):
+                    self.hits += 1
+                    return digests
+            self.misses += 1
+            return None
+
+    # touch and store are committed together by commit, once per batch of
+    # files
+    def touch(self, paths):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(touch_query, [(now, p) for p in paths])
+
+    def store(self, entries):
+        now = time.time()
+        rows = [
+            (path,) + stat_key(st) + (json.dumps(digests, sort_keys=True), now)
+            for path, st, digests in entries
+        ]
+        with self._lock:
+            self._conn.executemany(store_query, rows)
+            self._added(len(rows))
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+
+    def __str__(self):
+        return "Hash cache: {} hits, {} misses, {} evicted".format(
+            self.hits, self.misses, self.evicted
+        )
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import json
+import zlib
+
+# JSON request bodies for the OSC portal. orjson is used when it is
+# installed, the json module otherwise. A compressed body is built by feeding
+# the encoder output to the compressor chunk by chunk, so the uncompressed
+# JSON is never held as one string. A value of the top-level object with an
+# iter_json method, such as osc_manifest.Manifest, writes its own JSON in
+# chunks.
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# window bits of zlib.compressobj for each Content-Encoding
+WBITS = {"gzip": 31, "deflate": 15}
+CHUNK_SIZE = 1 << 16
+
+
+def dumps(obj):
+    if has_streamed_values(obj):
+        return b"".join(iter_json(obj))
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+def has_streamed_values(obj):
+    return isinstance(obj, dict) and any(hasattr(v, "iter_json") for v in obj.values())
+
+
+# Yields the JSON encoding of obj as byte chunks of about CHUNK_SIZE
+def iter_json(obj):
+    if has_streamed_values(obj):
+        for i, (k, v) in enumerate(obj.items()):
+            yield ("," if i else "{").encode() + dumps(str(k)) + b":"
+            if hasattr(v, "iter_json"):
+                yield from v.iter_json()
+            else:
+                yield from iter_json(v)
+        yield b"}"
+        return
+    if orjson is not None:
+        data = memoryview(orjson.dumps(obj))
+        for i in range(0, len(data), CHUNK_SIZE):
+            yield data[i : i + CHUNK_SIZE]
+        return
+    encoder = json.JSONEncoder(separators=(",", ":"))
+    parts = []
+    size = 0
+    for part in encoder.iterencode(obj):
+        parts.append(part)
+        size += len(part)
+        if size >= CHUNK_SIZE:
+            yield "".join(parts).encode()
+            parts = []
+            size = 0
+    if parts:
+        yield "".join(parts).encode()
+
+
+# Returns the body of obj compressed with encoding ("gzip", "deflate" or None
+# for no compression) and the size of its JSON encoding
+def encode_body(obj, encoding=None, level=6):
+    if encoding is None:
+        body = dumps(obj)
+        return body, len(body)
+    if encoding not in WBITS:
+        raise ValueError(f"Unknown content encoding '{encoding}'")
+    compressor = zlib.compressobj(level, zlib.DEFLATED, WBITS[encoding])
+    parts = []
+    size = 0
+    for chunk in iter_json(obj):
+        size += len(chunk)
+        parts.append(compressor.compress(chunk))
+    parts.append(compressor.flush())
+    return b"".join(parts), size
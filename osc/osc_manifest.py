@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import struct
+import sys
+import tempfile
+from array import array
+
+# Compact manifest of a contribution: the directory of every path is stored
+# once and referenced by index, file names are interned and digests are kept
+# as raw bytes in a single bytearray. Past spill_threshold entries the
+# manifest moves to a temporary file, so its memory stays bounded however
+# many files a contribution has. Hex digests and the JSON of the entries are
+# only produced while the request body is written.
+
+settings = {
+    # entries kept in memory before the manifest is moved to disk, 0 to
+    # never spill
+    "spill_threshold": 1000000,
+    # directory of the spill files, the system temporary directory if None
+    "spill_dir": None,
+}
+
+# length of the encoded path, then the path and the digest
+RECORD_HEADER = struct.Struct("<I")
+READ_SIZE = 1 << 20
+CHUNK_SIZE = 1 << 16
+
+
+def configure_manifest(**kwargs):
+    for k, v in kwargs.items():
+        if k not in settings:
+            raise ValueError(f"Unknown manifest setting '{k}'")
+        if v is not None:
+            settings[k] = v
+
+
+class Manifest:
+    def __init__(self, algorithm, digest_size, spill_threshold=None, spill_dir=None):
+        self.algorithm = algorithm
+        self.digest_size = digest_size
+        if spill_threshold is None:
+            spill_threshold = settings["spill_threshold"]
+        self.spill_threshold = spill_threshold
+        self.spill_dir = spill_dir or settings["spill_dir"]
+        self._dir_ids = {}
+        self._dirs = []
+        self._entry_dirs = array("I")
+        self._names = []
+        self._digests = bytearray()
+        self._count = 0
+        self._spill = None
+
+    def __len__(self):
+        return self._count
+
+    # digest is the raw digest, e.g. bytes.fromhex of the hex digest
+    def add(self, path, digest):
+        if len(digest) != self.digest_size:
+            raise ValueError(f"Digest of '{path}' is not {self.digest_size} bytes")
+        self._count += 1
+        if self._spill is not None:
+            self._write(path, digest)
+            return
+        # the directory keeps its trailing "/", so that directory + name is
+        # the path exactly as it was given
+        directory, sep, name = path.rpartition("/")
+        directory += sep
+        dir_id = self._dir_ids.get(directory)
+        if dir_id is None:
+            dir_id = self._dir_ids[directory] = len(self._dirs)
+            self._dirs.append(directory)
+        self._entry_dirs.append(dir_id)
+        self._names.append(sys.intern(name))
+        self._digests += digest
+        if self.spill_threshold and self._count > self.spill_threshold:
+            self._spill_to_disk()
+
+    def _spill_to_disk(self):
+        self._spill = tempfile.TemporaryFile(dir=self.spill_dir)
+        for path, digest in self._iter_memory():
+            self._write(path, digest)
+        self._dir_ids = {}
+        self._dirs = []
+        self._entry_dirs = array("I")
+        self._names = []
+        self._digests = bytearray()
+
+    def _write(self, path, digest):
+        data = os.fsencode(path)
+        self._spill.write(RECORD_HEADER.pack(len(data)) + data + digest)
+
+    def _iter_memory(self):
+        size = self.digest_size
+        for i, name in enumerate(self._names):
+            path = self._dirs[self._entry_dirs[i]] + name
+            yield path, bytes(self._digests[i * size : (i + 1) * size])
+
+    def _iter_disk(self):
+        self._spill.flush()
+        self._spill.seek(0)
+        header = RECORD_HEADER.size
+        buf = b""
+        try:
+            while True:
+                data = self._spill.read(READ_SIZE)
+                if not data:
+                    break
+                buf += data
+                pos = 0
+                while len(buf) - pos >= header:
+                    (length,) = RECORD_HEADER.unpack_from(buf, pos)
+                    end = pos + header + length + self.digest_size
+                    if end > len(buf):
+                        break
+                    path = os.fsdecode(buf[pos + header : pos + header + length])
+                    yield path, buf[end - self.digest_size : end]
+                    pos = end
+                buf = buf[pos:]
+        finally:
+            self._spill.seek(0, os.SEEK_END)
+
+    # Yields (path, raw digest) in the order the entries were added
+    def __iter__(self):
+        if self._spill is not None:
+            return self._iter_disk()
+        return self._iter_memory()
+
+    # Yields the JSON list of the manifest entries of the portal API, as byte
+    # chunks of about CHUNK_SIZE
+    def iter_json(self):
+        algorithm = json.dumps(self.algorithm)
+        parts = ["["]
+        size = 1
+        for i, (path, digest) in enumerate(self):
+            part = '{}{{"filename":{},"hash":"{}","algorithm":{}}}'.format(
+                "," if i else "", json.dumps(path), digest.hex(), algorithm
+            )
+            parts.append(part)
+            size += len(part)
+            if size >= CHUNK_SIZE:
+                yield "".join(parts).encode()
+                parts = []
+                size = 0
+        parts.append("]")
+        yield "".join(parts).encode()
+
+    def close(self):
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import json
+import time
+
+from osc.osc_sqlite_cache import SqliteLruCache
+
+# On-disk cache of OSC records keyed by their api/data/{id} URL, filled from
+# the responses of queries, contributions and updates. An entry younger than
+# the TTL is served without a request; an older one is revalidated with its
+# ETag / Last-Modified validators when the portal sent them. The cache is a
+# single SQLite file, so it can be shared by several runs.
+
+create_table_query = """CREATE TABLE IF NOT EXISTS records (
+    url TEXT PRIMARY KEY,
+    record TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    validated_at REAL NOT NULL,
+    last_used REAL NOT NULL
+)"""
+
+lookup_query = """SELECT record, etag, last_modified, validated_at
+FROM records
+WHERE url = ?"""
+
+store_query = """INSERT OR REPLACE INTO records
+    (url, record, etag, last_modified, validated_at, last_used)
+VALUES (?, ?, ?, ?, ?, ?)"""
+
+touch_query = "UPDATE records SET last_used = ? WHERE url = ?"
+
+revalidated_query = "UPDATE records SET validated_at = ?, last_used = ? WHERE url = ?"
+
+invalidate_query = "DELETE FROM records WHERE url = ?"
+
+
+class RecordCache(SqliteLruCache):
+    def __init__(self, path, ttl=86400, max_entries=100000):
+        super().__init__(path, "records", "url", create_table_query, max_entries)
+        self.ttl = ttl
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    # Returns the cached entry of url as a dict with the record, its
+    # validators and whether it is still fresh, None if there is none.
+    # A fresh entry counts as a hit.
+    def lookup(self, url):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(lookup_query, (url,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            fresh = now - row[3] < self.ttl
+            if fresh:
+                self.hits += 1
+                self._conn.execute(touch_query, (now, url))
+                self._conn.commit()
+        return {
+            "record": json.loads(row[0]),
+            "etag": row[1],
+            "last_modified": row[2],
+            "fresh": fresh,
+        }
+
+    # The portal answered 304 Not Modified for the cached entry of url
+    def mark_revalidated(self, url):
+        now = time.time()
+        with self._lock:
+            self.revalidated += 1
+            self._conn.execute(revalidated_query, (now, now, url))
+            self._conn.commit()
+
+    # Stores record for url. A full response after a lookup of a stale entry
+    # counts as a miss.
+    def store(self, url, record, etag=None, last_modified=None, miss=False):
+        now = time.time()
+        row = (url, json.dumps(record), etag, last_modified, now, now)
+        with self._lock:
+            if miss:
+                self.misses += 1
+            self._conn.execute(store_query, row)
+            self._added(1)
+            self._conn.commit()
+
+    def invalidate(self, url):
+        with self._lock:
+            cursor = self._conn.execute(invalidate_query, (url,))
+            self._removed(cursor.rowcount)
+            self._conn.commit()
+
+    def __str__(self):
+        return "Record cache: {} hits, {} revalidated, {} misses, {} evicted".format(
+            self.hits, self.revalidated, self.misses, self.evicted
+        )
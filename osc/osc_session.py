@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+# Shared HTTP session for every call made to the OSC portal. Connections are
+# kept alive and pooled, transient failures are retried with jittered
+# exponential backoff and every request gets a (connect, read) timeout.
+# Reads and writes go through separate adaptive limiters that bound the
+# number of concurrent requests and back off when the portal throttles.
+# JSON bodies can be sent compressed; a host that rejects a compressed body
+# gets uncompressed ones for the rest of the process. requests (and urllib3)
+# are imported when the first session is created.
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# the portal did not process the request, so it is safe to retry a write
+THROTTLE_STATUS = {429, 503}
+# response of a server that does not accept the Content-Encoding of a body
+UNSUPPORTED_MEDIA_TYPE = 415
+
+settings = {
+    "pool_size": 10,
+    "retries": 3,
+    "backoff": 0.5,
+    "max_backoff": 30.0,
+    "connect_timeout": 10.0,
+    "read_timeout": 300.0,
+    # called as observer(method, url, status, seconds, attempt) after every
+    # attempt, status is None when no response was received
+    "observer": None,
+    # AIMD concurrency limits per kind of request ("read" or "write"). The
+    # limit grows by one per limit successful requests and is halved when
+    # the portal throttles (429/503); it shrinks by latency_decrease when the
+    # recent latency rises above latency_tolerance times the long-term one.
+    "adaptive": True,
+    "initial_concurrency": 4,
+    "min_concurrency": 1,
+    "max_read_concurrency": 16,
+    "max_write_concurrency": 8,
+    "latency_tolerance": 2.0,
+    "latency_decrease": 0.9,
+    # requests per second per kind, 0 for no rate limit
+    "max_read_rate": 0,
+    "max_write_rate": 0,
+    # upper bound of a Retry-After the client is willing to honor
+    "max_retry_after": 300.0,
+    # Content-Encoding of JSON request bodies, "gzip", "deflate" or None
+    "compress": None,
+    "compress_level": 6,
+}
+
+_session = None
+_session_lock = threading.Lock()
+_limiters = {}
+_uncompressed_hosts = set()
+_body_stats = {"bodies": 0, "json_bytes": 0, "sent_bytes": 0, "fallbacks": 0}
+
+
+def configure_session(**kwargs):
+    global _session
+    for k, v in kwargs.items():
+        if k not in settings:
+            raise ValueError(f"Unknown session setting '{k}'")
+        if v is not None:
+            settings[k] = v
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+        _limiters.clear()
+        _uncompressed_hosts.clear()
+
+
+class AdaptiveLimiter:
+    def __init__(self, initial, minimum, maximum, rate=0):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.limit = float(min(max(initial, minimum), self.maximum))
+        self.rate = rate
+        self.in_flight = 0
+        self.throttled = 0
+        self._recent = None
+        self._baseline = None
+        self._next_start = 0.0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    # Blocks until a request can start, returns the time it started at
+    def acquire(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                wait = max(self._paused_until, self._next_start) - now
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    break
+                self._cond.wait(wait if wait > 0 else None)
+            self.in_flight += 1
+            if self.rate > 0:
+                self._next_start = max(now, self._next_start) + 1 / self.rate
+        return time.perf_counter()
+
+    # status is None when no response was received
+    def release(self, status, latency, retry_after=None):
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if status in THROTTLE_STATUS:
+                self.throttled += 1
+                self._decrease(now, 0.5)
+                if retry_after:
+                    self._paused_until = max(self._paused_until, now + retry_after)
+            elif status is not None and status < 500:
+                if self._baseline is None:
+                    self._recent = self._baseline = latency
+                self._recent += 0.2 * (latency - self._recent)
+                self._baseline += 0.01 * (latency - self._baseline)
+                if self._recent > settings["latency_tolerance"] * self._baseline:
+                    self._decrease(now, settings["latency_decrease"])
+                else:
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    # At most one decrease per baseline latency, so that the requests in
+    # flight when the portal starts throttling count as a single signal
+    def _decrease(self, now, factor):
+        if now - self._last_decrease < (self._baseline or 0):
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit * factor)
+
+
+def get_limiter(kind):
+    with _session_lock:
+        if kind not in _limiters:
+            _limiters[kind] = AdaptiveLimiter(
+                settings["initial_concurrency"],
+                settings["min_concurrency"],
+                settings[f"max_{kind}_concurrency"],
+                settings[f"max_{kind}_rate"],
+            )
+        return _limiters[kind]
+
+
+# Returns {kind: current concurrency limit}
+def limits():
+    with _session_lock:
+        return {kind: int(limiter.limit) for kind, limiter in _limiters.items()}
+
+
+def retry_after_seconds(res):
+    value = res.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(0.0, seconds), settings["max_retry_after"])
+
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            import urllib3
+            from requests.adapters import HTTPAdapter
+
+            # the portal is called with verify=False, suppress only the
+            # warning urllib3 gives for that
+            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+            session = requests.Session()
+            # retries are handled in request() so that they can be jittered
+            adapter = HTTPAdapter(
+                pool_connections=settings["pool_size"],
+                pool_maxsize=settings["pool_size"],
+                max_retries=0,
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def backoff_delay(attempt):
+    cap = min(settings["max_backoff"], settings["backoff"] * (2**attempt))
+    return random.uniform(0, cap)
+
+
+# Non idempotent requests (contribute) are only retried when the request
+# cannot have reached the portal, i.e. when the connection was never
+# established, to avoid creating duplicate OSC records.
+def is_retryable(err, idempotent):
+    import requests
+    from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+    if isinstance(err, requests.exceptions.ConnectTimeout):
+        return True
+    reason = err.args[0] if err.args else None
+    if isinstance(reason, MaxRetryError) and isinstance(
+        reason.reason, NewConnectionError
+    ):
+        return True
+    if not idempotent:
+        return False
+    return isinstance(
+        err, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+    )
+
+
+# kind is "read" or "write" and selects the limiter, by default GET requests
+# are reads and everything else is a write
+def request(method, url, idempotent=True, kind=None, **kwargs):
+    kwargs.setdefault(
+        "timeout", (settings["connect_timeout"], settings["read_timeout"])
+    )
+    if kind is None:
+        kind = "read" if method == "GET" else "write"
+    import requests
+
+    limiter = get_limiter(kind) if settings["adaptive"] else None
+    session = get_session()
+    attempt = 0
+    while True:
+        start = limiter.acquire() if limiter else time.perf_counter()
+        delay = None
+        try:
+            res = session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException as err:
+            observe(method, url, None, start, attempt)
+            if limiter:
+                limiter.release(None, time.perf_counter() - start)
+            if attempt >= settings["retries"] or not is_retryable(err, idempotent):
+                raise
+            print(f"Request to {url} failed ({err}), retrying")
+        else:
+            observe(method, url, res.status_code, start, attempt)
+            if res.status_code in THROTTLE_STATUS:
+                delay = retry_after_seconds(res)
+            if limiter:
+                limiter.release(res.status_code, time.perf_counter() - start, delay)
+            if (
+                res.status_code not in RETRY_STATUS
+                or attempt >= settings["retries"]
+                or (not idempotent and res.status_code not in THROTTLE_STATUS)
+            ):
+                return res
+            print(f"Request to {url} returned {res.status_code}, retrying")
+            res.close()
+        if delay is None:
+            delay = backoff_delay(attempt)
+        time.sleep(delay)
+        attempt += 1
+
+
+def observe(method, url, status, start, attempt):
+    if settings["observer"] is not None:
+        settings["observer"](method, url, status, time.perf_counter() - start, attempt)
+
+
+# Sends obj as a JSON body, compressed according to settings["compress"].
+# If the host rejects the compressed body it is sent again uncompressed.
+def request_json(method, url, obj, headers=None, **kwargs):
+    # the JSON encoders are only loaded by contributions and updates
+    from osc.osc_json import encode_body
+
+    headers = dict(headers or {})
+    encoding = settings["compress"]
+    host = urlparse(url).netloc
+    if encoding and host not in _uncompressed_hosts:
+        body, size = encode_body(obj, encoding, settings["compress_level"])
+        res = request(
+            method,
+            url,
+            data=body,
+            headers=dict(headers, **{"Content-Encoding": encoding}),
+            **kwargs,
+        )
+        if not rejects_encoding(res, encoding):
+            count_body(size, len(body))
+            return res
+        print(f"{host} rejected a {encoding} request body, sending it uncompressed")
+        res.close()
+        with _session_lock:
+            _uncompressed_hosts.add(host)
+            _body_stats["fallbacks"] += 1
+    body, size = encode_body(obj)
+    res = request(method, url, data=body, headers=headers, **kwargs)
+    count_body(size, len(body))
+    return res
+
+
+# A 415, or a 400 that names the encoding. Any other 400 is about the
+# payload and would fail uncompressed too.
+def rejects_encoding(res, encoding):
+    if res.status_code == UNSUPPORTED_MEDIA_TYPE:
+        return True
+    if res.status_code != 400:
+        return False
+    text = res.text.lower()
+    return "encoding" in text or encoding in text
+
+
+def count_body(json_bytes, sent_bytes):
+    with _session_lock:
+        _body_stats["bodies"] += 1
+        _body_stats["json_bytes"] += json_bytes
+        _body_stats["sent_bytes"] += sent_bytes
+
+
+# Returns the number of JSON bodies sent, their size before and after
+# compression and the number of compressed bodies that were rejected
+def body_stats():
+    with _session_lock:
+        return dict(_body_stats)
+
+
+def format_body_stats(stats):
+    saved = stats["json_bytes"] - stats["sent_bytes"]
+    return "Request bodies: {} sent, {:.1f} MB for {:.1f} MB of JSON ({:.0%} saved)".format(
+        stats["bodies"],
+        stats["sent_bytes"] / 1e6,
+        stats["json_bytes"] / 1e6,
+        saved / stats["json_bytes"] if stats["json_bytes"] else 0,
+    )
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, idempotent=False, **kwargs):
+    return request("POST", url, idempotent=idempotent, **kwargs)
+
+
+def put(url, **kwargs):
+    return request("PUT", url, **kwargs)
+
+
+def post_json(url, obj, idempotent=False, **kwargs):
+    return request_json("POST", url, obj, idempotent=idempotent, **kwargs)
+
+
+def put_json(url, obj, **kwargs):
+    return request_json("PUT", url, obj, **kwargs)
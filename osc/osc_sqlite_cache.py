@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import os
+import sqlite3
+import threading
+
+# SQLite scaffolding shared by the on-disk caches (osc_hash_cache and
+# osc_record_cache): one table keyed by a single column, with a last_used
+# column by which the least recently used entries are evicted. The number of
+# entries is kept as a running upper bound (a replaced row counts as a new
+# one), so storing an entry does not count the table. The table is only
+# counted when the bound passes max_entries, and then the cache is brought
+# down to LOW_WATER of max_entries in one DELETE.
+
+LOW_WATER = 0.9
+
+
+class SqliteLruCache:
+    def __init__(self, path, table, key, create_table_query, max_entries):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.evicted = 0
+        self._table = table
+        self._evict_query = f"""DELETE FROM {table} WHERE {key} IN (
+    SELECT {key} FROM {table} ORDER BY last_used LIMIT ?)"""
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # with WAL, synchronous=NORMAL only syncs at checkpoints: a crash can
+        # lose the last commits, which a cache can afford, but not corrupt it
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(create_table_query)
+        self._conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {table}_last_used ON {table} (last_used)"
+        )
+        self._conn.commit()
+        self._entries = self._count()
+
+    def _count(self):
+        return self._conn.execute(f"SELECT COUNT(*) FROM {self._table}").fetchone()[0]
+
+    # Called with the lock held after n rows were inserted or replaced
+    def _added(self, n):
+        self._entries += n
+        if self._entries <= self.max_entries:
+            return
+        self._entries = self._count()
+        if self._entries > self.max_entries:
+            evict = self._entries - int(self.max_entries * LOW_WATER)
+            self._conn.execute(self._evict_query, (evict,))
+            self.evicted += evict
+            self._entries -= evict
+
+    # Called with the lock held after n rows were deleted
+    def _removed(self, n):
+        self._entries = max(0, self._entries - n)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
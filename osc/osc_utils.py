@@ -1,5 +1,9 @@
 #!/usr/bin/env python3
 
+import json
+
+FUNDING_AGENCIES = ["NASA", "NIH", "NOAA", "NSF"]
+
 
 def add_header(fout):
     fout.write("---\n")
@@ -128,8 +132,7 @@ def add_association(res_json, fout):
 def add_funding(res_json, fout):
     fout.write('# Funding agency, add "true"  after ":" to select the agency\n')
     fout.write("Funding:\n")
-    lst = ["NASA", "NIH", "NOAA", "NSF"]
-    for i in lst:
+    for i in FUNDING_AGENCIES:
         if i in res_json["fundingAgencies"]:
             fout.write(" - " + i + ": true\n")
         else:
@@ -168,43 +171,24 @@ def add_other(res_json, fout):
     return
 
 
-def update_summary(new_files, old_files, updated_files, deleted_files, id):
+# Prints the counts of an osc_diff.ManifestDiff and writes its report as JSON
+# to {dest_prefix}changes-{id}.json, unless dest_prefix is None
+def update_summary(diff, id, dest_prefix=""):
+    counts = diff.counts()
     print("Summary of changes due to this update:")
-    print("Number of new files: ", len(new_files))
-    print("Number of unchanged files: ", len(old_files))
-    print("Number of updated files: ", len(updated_files))
-    print("Number of deleted files: ", len(deleted_files))
-    fout = open("changes.txt-" + id, "w")
-
-    if len(new_files) > 0:
-        fout.write("New files:\n")
-        for f in new_files:
-            fout.write(f + "\n")
-        fout.write("\n")
-
-    if len(updated_files) > 0:
-        fout.write("Updated files:\n")
-        for f in updated_files:
-            fout.write(f + "\n")
-        fout.write("\n")
-
-    if len(old_files) > 0:
-        fout.write("Unchanged files:\n")
-        for f in old_files:
-            fout.write(f + "\n")
-        fout.write("\n")
-
-    if len(deleted_files) > 0:
-        fout.write("Deleted files:\n")
-        for f in deleted_files:
-            fout.write(f + "\n")
-        fout.write("\n")
-
-    fout.close()
-
+    print("Number of new files: ", counts["new"])
+    print("Number of unchanged files: ", counts["unchanged"])
+    print("Number of updated files: ", counts["updated"])
+    print("Number of deleted files: ", counts["deleted"])
+    if dest_prefix is None:
+        return
+
+    report_path = f"{dest_prefix}changes-{id}.json"
+    with open(report_path, "w") as fout:
+        json.dump(diff.report(), fout, separators=(",", ":"))
     print(
-        "Please check 'changes.txt-"
-        + id
+        "Please check '"
+        + report_path
         + "' for details and then continue with the update operation."
     )
     # inp = input("Continue with the update operation (Y/N): ")
@@ -222,8 +206,8 @@ def print_summary(res):
         print("Keywords: {}".format(res["keywords"]))
 
 
-def save_query_result(res_json):
-    with open(res_json["id"] + ".yaml", "w") as fout:
+def save_query_result(res_json, dest_path=""):
+    with open(dest_path + res_json["id"] + ".yaml", "w") as fout:
         add_header(fout)
         add_token(res_json, fout)
         add_osc_id(res_json, fout)
@@ -241,6 +225,41 @@ def save_query_result(res_json):
         fout.close()
 
 
+def optional_field(res_json, key):
+    value = res_json.get(key)
+    if value is None or value == "":
+        return None
+    if isinstance(value, list):
+        return ", ".join(value)
+    return value
+
+
+# Returns the template that save_query_result writes for res_json, as the
+# dict that loading the saved yaml file gives back
+def record_to_template(res_json):
+    manifest_lst = res_json["manifest"]
+    return {
+        "Token": None,
+        "OSC-ID": res_json["id"],
+        "Files": [i["filename"] for i in manifest_lst] or None,
+        "Directories": None,
+        "ExcludeList": None,
+        "Title": optional_field(res_json, "title"),
+        "Description": optional_field(res_json, "description"),
+        "Keywords": optional_field(res_json, "keywords"),
+        "DOI": optional_field(res_json, "doi"),
+        "URL": optional_field(res_json, "url"),
+        "Funding": [
+            {i: True if i in res_json["fundingAgencies"] else None}
+            for i in FUNDING_AGENCIES
+        ],
+        "AssociatedID": optional_field(res_json, "otherDataIdName"),
+        "AssociatedIDVal": optional_field(res_json, "otherDataIdValue"),
+        "Acknowledgment": optional_field(res_json, "acknowledgment"),
+        "Manifest": [{i["filename"]: i["hash"]} for i in manifest_lst] or None,
+    }
+
+
 # # testing the above functions
 # f = open("osc-598ccdc6-9307-4ee5-91d6-3d17c6ef6b23.dat") #osc-c589dc59-38e5-497f-8d0c-d6085771a074.json")
 # fout = open("test-out.yaml", "w")
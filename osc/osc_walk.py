@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import fnmatch
+import os
+import re
+import stat
+
+# Single pass directory walker built on os.scandir. Excluded directories are
+# pruned before they are listed, and every file is yielded with the stat
+# result the hasher reuses. Like glob.glob(d + "/**", recursive=True), which
+# it replaces, it skips hidden entries and follows symbolic links to
+# directories (a directory already on the current path is not entered again).
+
+MAGIC = re.compile(r"[*?[]")
+
+
+# An exclude list entry is a path or a glob pattern (fnmatch syntax, where *
+# also matches "/"). A pattern without "/" is matched against the name of
+# every file and directory, any other against its whole path.
+class ExcludeMatcher:
+    def __init__(self, patterns=()):
+        self.paths = set()
+        path_patterns = []
+        name_patterns = []
+        for pattern in patterns or ():
+            pattern = str(pattern)
+            if not MAGIC.search(pattern):
+                self.paths.add(os.path.normpath(pattern))
+            elif "/" in pattern:
+                path_patterns.append(fnmatch.translate(os.path.normpath(pattern)))
+            else:
+                name_patterns.append(fnmatch.translate(pattern))
+        self.path_regex = re.compile("|".join(path_patterns)) if path_patterns else None
+        self.name_regex = re.compile("|".join(name_patterns)) if name_patterns else None
+
+    def __bool__(self):
+        return bool(self.paths or self.path_regex or self.name_regex)
+
+    def matches(self, path, name=None):
+        if not self:
+            return False
+        path = os.path.normpath(path)
+        if path in self.paths:
+            return True
+        if self.path_regex is not None and self.path_regex.match(path):
+            return True
+        if name is None:
+            name = os.path.basename(path)
+        return self.name_regex is not None and self.name_regex.match(name) is not None
+
+    # Like matches, but also true if a directory above path is excluded, for
+    # paths that do not come from walk_files (which prunes those directories)
+    def excludes(self, path):
+        if not self:
+            return False
+        path = os.path.normpath(path)
+        while True:
+            if self.matches(path):
+                return True
+            parent = os.path.dirname(path)
+            if parent in ("", path) or os.path.basename(parent) == "..":
+                return False
+            path = parent
+
+
+# Yields (path, stat_result) for every regular file under root that is not
+# excluded, the entries of every directory in name order. Unreadable
+# directories are reported and skipped.
+def walk_files(root, exclude=None):
+    if not isinstance(exclude, ExcludeMatcher):
+        exclude = ExcludeMatcher(exclude)
+    if exclude.matches(root):
+        return
+    try:
+        root_st = os.stat(root)
+    except OSError as err:
+        print("Error: " + str(err))
+        return
+    # directories still to list, with the (device, inode) of their ancestors
+    stack = [(root, frozenset([(root_st.st_dev, root_st.st_ino)]))]
+    while stack:
+        path, ancestors = stack.pop()
+        try:
+            with os.scandir(path) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError as err:
+            print("Error: " + str(err))
+            continue
+        subdirs = []
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            if exclude and exclude.matches(entry.path, entry.name):
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                # dangling symbolic link
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                key = (st.st_dev, st.st_ino)
+                if key not in ancestors:
+                    subdirs.append((entry.path, ancestors | {key}))
+            elif stat.S_ISREG(st.st_mode):
+                yield entry.path, st
+        # reversed, so the subdirectories are walked in name order
+        stack.extend(reversed(subdirs))